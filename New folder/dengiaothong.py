@@ -1,12 +1,23 @@
-import random
 import time
+STARTED_AT = time.perf_counter()  # Mốc đo thời gian khởi động của CLI
+
+import random
+import sys
+import argparse
 import json
 import os
 from datetime import datetime
 import threading
-import http.server
-import socketserver
-import webbrowser
+import queue
+import atexit
+import bisect
+import functools
+import heapq
+import hashlib
+import io
+import itertools
+from collections import deque
+import numpy as np
 
 # ==============================
 # ⚙️ CẤU HÌNH NÂNG CAO
@@ -30,56 +41,325 @@ CONFIG = {
     "CAR_SPEED_EMERGENCY": 15,
     "CAR_SPEED_SLOW": 5,
     "MAX_CARS_PER_LANE": 8,
-    "CAR_SPAWN_PROB": 0.3
+    "HEADWAY": 40,  # Khoảng cách tối thiểu giữa hai xe cùng làn (px)
+    "CONTROLLER": "ladder",  # Bộ điều khiển đèn: ladder, fixed, webster, max_pressure hoặc "module:Lớp"
+    "MAX_GREEN": 45,  # Thời gian xanh tối đa của các bộ điều khiển fixed/webster/max_pressure
+    "DENSITY_THRESHOLDS": (5, 10, 15),  # Tổng số xe để bộ ladder cộng thêm 3/5/8 giây xanh
+    # Ma trận xung đột: 1 nếu hai làn không được cùng đi (xanh hoặc vàng) một lúc.
+    # Làn 0, 1 là hướng Đông-Tây, làn 2, 3 là hướng Bắc-Nam
+    "LANE_CONFLICTS": [[0, 0, 1, 1], [0, 0, 1, 1], [1, 1, 0, 0], [1, 1, 0, 0]],
+    # Các pha đèn chạy lần lượt mỗi chu kỳ: (tên, các làn được xanh). Vd. rẽ trái bảo vệ
+    # với làn 1, 3 là làn rẽ trái (thêm xung đột 0-1, 2-3 vào LANE_CONFLICTS):
+    # [("Đông-Tây", [0]), ("Đông-Tây rẽ trái", [1]), ("Bắc-Nam", [2]), ("Bắc-Nam rẽ trái", [3])]
+    "SIGNAL_PHASES": [("Đông-Tây", [0, 1]), ("Bắc-Nam", [2, 3])],
+    "CAR_SPAWN_PROB": 0.3,
+    "TICK_RATE": 2,  # Số bước mô phỏng mỗi giây (2 FPS); tốc độ CAR_SPEED_* tính theo px/bước ở 2 FPS
+    "CYCLE_GAP": 2,  # Nghỉ giữa các chu kỳ (giây)
+    "WARMUP_MINUTES": 0,  # Chạy trước bao nhiêu phút mô phỏng hết tốc lực trước khi mở dashboard
+    "STATE_FILE": None,  # Đặt "traffic_data.json" để vẫn ghi trạng thái ra file như trước
+    "KEYFRAME_INTERVAL": 20,  # Cứ bao nhiêu khung thì gửi một khung đầy đủ
+    "LOG_FLUSH_INTERVAL": 1.0,  # Ghi log ra file tối đa sau bao nhiêu giây
+    "LOG_BATCH_SIZE": 256,  # Số dòng log tối đa mỗi lần ghi
+    "LOG_BUFFER_SIZE": 100,  # Số dòng log giữ trong bộ nhớ cho dashboard
+    # Mức log tối thiểu cho từng nơi nhận: màn hình, file, dashboard
+    "LOG_LEVELS": {"console": "INFO", "file": "INFO", "dashboard": "INFO"},
+    "HTTP_PORT": 8000,
+    "HTTP_MAX_WORKERS": 128,  # Số kết nối được phục vụ cùng lúc (mỗi luồng SSE giữ một)
+    "HTTP_QUEUE_TIMEOUT": 2.0,  # Chờ luồng rảnh tối đa bao lâu trước khi trả 503
+    "HTTP_TIMEOUT": 30,  # Đóng kết nối im lặng hoặc quá chậm sau bao nhiêu giây
+    "HTTP_KEEPALIVE_TIMEOUT": 5,  # Đóng kết nối keep-alive rảnh giữa hai request sau bao nhiêu giây
+    "CACHE_DIR": ".sim_cache",  # Thư mục lưu kết quả chạy headless của replicate/tune
+    "CACHE_MAX_BYTES": 256 * 1024 * 1024,  # Vượt dung lượng này thì xóa kết quả lâu không dùng nhất
+    "PROFILING": False  # Đo thời gian từng giai đoạn (spawn, update, scan, ghi trạng thái, log) cho /metrics
 }
 
 HTML_FILE = "traffic_simulation.html"
 
+# ==============================
+# ⏱️ ĐỒNG HỒ MÔ PHỎNG
+# ==============================
+class WallClock:
+    # Đồng hồ thời gian thực - dùng khi chạy cùng dashboard. Đơn điệu: hạn của các
+    # bước không bị xô lệch khi giờ hệ thống bị chỉnh (NTP, đổi múi giờ)
+    def now(self):
+        return time.monotonic()
+    
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+    
+    def sleep_until(self, at):
+        self.sleep(at - self.now())
+
+class VirtualClock:
+    # Đồng hồ ảo - thời gian chỉ tiến khi mô phỏng bước tới, không ngủ thật
+    def __init__(self, start=0.0):
+        self.current = start
+    
+    def now(self):
+        return self.current
+    
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.current += seconds
+    
+    def sleep_until(self, at):
+        # Nhảy thẳng tới thời điểm của sự kiện kế tiếp
+        self.current = max(self.current, at)
+
+# ==============================
+# 📅 BỘ LẬP LỊCH SỰ KIỆN
+# ==============================
+# Thứ tự xử lý khi nhiều sự kiện trùng thời điểm và việc xe có đi bước
+# tại chính thời điểm đó trước khi xử lý sự kiện hay không
+EVENT_TYPES = {
+    "phase": (0, False),         # Đèn đổi pha
+    "cycle_end": (0, False),     # Kết thúc chu kỳ đèn
+    "spawn": (1, False),         # Xe mới tới - đi ngay trong bước tại thời điểm tới
+    "priority_end": (2, True),   # Hết thời gian ưu tiên
+    "render": (3, True)          # Xuất dữ liệu sau khi xe đã đi
+}
+
+class EventScheduler:
+    def __init__(self):
+        self.queue = []
+        self.counter = itertools.count()
+    
+    def __len__(self):
+        return len(self.queue)
+    
+    def push(self, at, kind, payload=None):
+        order = EVENT_TYPES[kind][0]
+        heapq.heappush(self.queue, (at, order, next(self.counter), kind, payload))
+    
+    def restore(self, entries):
+        # Nạp lại hàng đợi từ điểm lưu; bộ đếm tiếp tục sau số lớn nhất để giữ thứ tự
+        self.queue = [tuple(entry) for entry in entries]
+        heapq.heapify(self.queue)
+        self.counter = itertools.count(max((entry[2] for entry in self.queue), default=-1) + 1)
+    
+    def peek_time(self):
+        return self.queue[0][0] if self.queue else None
+    
+    def pop(self):
+        at, _, _, kind, payload = heapq.heappop(self.queue)
+        return at, kind, payload
+
+# ==============================
+# 📈 ĐO THỜI GIAN TỪNG GIAI ĐOẠN
+# ==============================
+class StageProfiler:
+    # Số lần chạy và phân bố thời gian của từng giai đoạn theo ngưỡng của histogram
+    # Prometheus. Khi tắt, mỗi lần gọi hàm được đo chỉ tốn một phép kiểm tra cờ
+    BUCKETS = (0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)  # giây
+    
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # giai đoạn -> [số lần theo từng ngưỡng..., số lần vượt ngưỡng cuối, tổng giây]
+        self.stages = {}
+    
+    def observe(self, stage, seconds):
+        counts = self.stages.get(stage)
+        if counts is None:
+            counts = self.stages.setdefault(stage, [0] * (len(self.BUCKETS) + 2))
+        counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        counts[-1] += seconds
+    
+    def reset(self):
+        self.stages = {}
+    
+    def summary(self):
+        # [(giai đoạn, số lần, tổng giây)], tốn nhiều thời gian nhất trước
+        rows = [(stage, sum(counts[:-1]), counts[-1]) for stage, counts in list(self.stages.items())]
+        return sorted(rows, key=lambda row: -row[2])
+    
+    def prometheus_lines(self):
+        lines = ["# HELP traffic_stage_seconds Thời gian mỗi lần chạy của từng giai đoạn mô phỏng",
+                 "# TYPE traffic_stage_seconds histogram"]
+        for stage, counts in list(self.stages.items()):
+            counts = list(counts)  # Chép lại: luồng mô phỏng vẫn đang ghi
+            total = 0
+            for bound, count in zip((*self.BUCKETS, "+Inf"), counts):
+                total += count
+                lines.append(f'traffic_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {total}')
+            lines.append(f'traffic_stage_seconds_sum{{stage="{stage}"}} {counts[-1]}')
+            lines.append(f'traffic_stage_seconds_count{{stage="{stage}"}} {total}')
+        return lines
+
+profiler = StageProfiler(CONFIG["PROFILING"])
+
+def profiled(stage):
+    # Đo thời gian mỗi lần gọi hàm vào giai đoạn `stage` khi profiler bật
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.observe(stage, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
 # ==============================
 # 📜 HỆ THỐNG LOG NÂNG CAO
 # ==============================
+class BufferedLogWriter:
+    # Luồng nền giữ file log mở và ghi theo lô, luồng mô phỏng chỉ việc bỏ
+    # dòng vào hàng đợi nên không bao giờ phải chờ ổ đĩa
+    _CLOSE = object()
+    
+    def __init__(self, path, flush_interval=None, batch_size=None):
+        # Đường dẫn tuyệt đối: web server đổi thư mục làm việc sau khi log đã bắt đầu
+        self.path = os.path.abspath(path)
+        self.flush_interval = flush_interval or CONFIG["LOG_FLUSH_INTERVAL"]
+        self.batch_size = batch_size or CONFIG["LOG_BATCH_SIZE"]
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+    
+    def write(self, line):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self.thread.start()
+        self.queue.put(line)
+    
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            closing = False
+            while not closing:
+                # Chờ dòng đầu tiên, sau đó gom thêm cho tới khi đủ lô hoặc hết hạn
+                item = self.queue.get()
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is self._CLOSE:
+                        closing = True
+                        break
+                    batch.append(item)
+                    remaining = deadline - time.monotonic()
+                    if len(batch) >= self.batch_size or remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                
+                if batch:
+                    self.write_batch(f, batch)
+    
+    @profiled("log_write")
+    def write_batch(self, f, batch):
+        f.write("\n".join(batch) + "\n")
+        f.flush()
+    
+    def close(self):
+        # Ghi nốt các dòng còn trong hàng đợi rồi đóng file
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(self._CLOSE)
+                self.thread.join()
+                self.thread = None
+
+# Mức độ của các loại log; loại không có trong bảng được coi như INFO
+LOG_LEVELS = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "CYCLE": 20,
+    "PRIORITY": 25,
+    "SYSTEM": 30,
+    "WARNING": 30,
+    "ERROR": 40,
+    "OFF": 100
+}
+
 class TrafficLogger:
-    def __init__(self, log_file):
+    def __init__(self, log_file, capacity=None, levels=None):
         self.log_file = log_file
-        self.entries = []
+        self.writer = BufferedLogWriter(log_file)
+        # Bộ đệm vòng: chỉ giữ các dòng mới nhất, bộ nhớ không tăng theo thời gian chạy
+        self.entries = deque(maxlen=capacity or CONFIG["LOG_BUFFER_SIZE"])
+        self.total = 0  # Tổng số dòng đã vào bộ đệm, dùng làm số thứ tự
+        self.min_levels = {}
+        self.set_levels(**(levels or CONFIG["LOG_LEVELS"]))
+    
+    def set_levels(self, console=None, file=None, dashboard=None):
+        for sink, level in (("console", console), ("file", file), ("dashboard", dashboard)):
+            if level is not None:
+                self.min_levels[sink] = LOG_LEVELS[level]
+        self.min_level = min(self.min_levels.values())
+    
+    @profiled("logger")
+    def log(self, message, level="INFO", *args):
+        # Tham số kiểu "%s" chỉ được ghép vào message khi có nơi nhận dòng log này
+        rank = LOG_LEVELS.get(level, LOG_LEVELS["INFO"])
+        if rank < self.min_level:
+            return None
+        if args:
+            message = message % args
         
-    def log(self, message, level="INFO"):
         timestamp = datetime.now().strftime("%H:%M:%S")
         log_entry = f"[{timestamp}] [{level}] {message}"
-        print(log_entry)
+        if rank >= self.min_levels["console"]:
+            print(log_entry)
         
         # Thêm vào bộ nhớ
-        self.entries.append(log_entry)
+        if rank >= self.min_levels["dashboard"]:
+            self.entries.append(log_entry)
+            self.total += 1
         
-        # Ghi vào file
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry + "\n")
+        # Ghi vào file (qua luồng nền)
+        if rank >= self.min_levels["file"]:
+            self.writer.write(log_entry)
         
         return log_entry
     
     def get_recent_logs(self, count=15):
-        return self.entries[-count:] if self.entries else []
+        count = min(count, len(self.entries))
+        return list(itertools.islice(self.entries, len(self.entries) - count, None))
+    
+    def get_logs_since(self, seq):
+        # Các dòng ghi sau dòng thứ `seq` cùng số thứ tự mới
+        new_count = min(self.total - seq, len(self.entries))
+        return self.total, self.get_recent_logs(new_count) if new_count > 0 else []
+
+    def set_log_file(self, log_file):
+        # Đổi file log: ghi nốt các dòng đang chờ vào file cũ trước
+        self.writer.close()
+        self.log_file = log_file
+        self.writer = BufferedLogWriter(log_file)
+
+    def close(self):
+        self.writer.close()
 
 # Khởi tạo logger
 logger = TrafficLogger(CONFIG["LOG_FILE"])
+atexit.register(logger.close)
 
 # ==============================
 # 🚗 LỚP XE NÂNG CAO
 # ==============================
 class Car:
     CAR_TYPES = {
-        "normal": {"emoji": "🚗", "speed": CONFIG["CAR_SPEED_NORMAL"], "priority": 0},
+        "normal": {"emoji": "🚘", "speed": CONFIG["CAR_SPEED_NORMAL"], "priority": 0},
         "emergency": {"emoji": "🚑", "speed": CONFIG["CAR_SPEED_EMERGENCY"], "priority": 3},
         "police": {"emoji": "🚓", "speed": CONFIG["CAR_SPEED_EMERGENCY"], "priority": 2},
         "fire": {"emoji": "🚒", "speed": CONFIG["CAR_SPEED_EMERGENCY"], "priority": 1},
         "truck": {"emoji": "🚚", "speed": CONFIG["CAR_SPEED_SLOW"], "priority": 0},
         "bus": {"emoji": "🚌", "speed": CONFIG["CAR_SPEED_SLOW"], "priority": 0}
     }
+    TYPE_NAMES = list(CAR_TYPES)
+    TYPE_IDS = {name: i for i, name in enumerate(TYPE_NAMES)}
     
-    def __init__(self, lane, car_type="normal"):
+    def __init__(self, lane, car_type="normal", rng=None):
+        self.rng = rng or random  # Bộ sinh số ngẫu nhiên của nút giao chứa xe
         self.lane = lane
         self.type = car_type
-        self.position = random.randint(-100, -20)  # Xuất hiện từ ngoài màn hình
+        self.position = self.rng.randint(-100, -20)  # Xuất hiện từ ngoài màn hình
         self.speed = self.CAR_TYPES[car_type]["speed"]
         self.priority = self.CAR_TYPES[car_type]["priority"]
         self.emoji = self.CAR_TYPES[car_type]["emoji"]
@@ -87,10 +367,14 @@ class Car:
         self.passed = False
         
     def move(self, light_state, priority_active):
+        # Phiên bản cho từng xe - VehicleStore.move áp dụng cùng luật cho cả mảng
+        # light_state: một trạng thái cho cả nút, hoặc trạng thái của từng làn
+        if not isinstance(light_state, str):
+            light_state = light_state[self.lane]
         # Xe ưu tiên luôn di chuyển bất kể đèn giao thông
         if self.priority > 0 and priority_active:
             self.position += self.speed + 5  # Tăng tốc khi có ưu tiên
-# Xe thường chỉ di chuyển khi đèn xanh hoặc vàng
+        # Xe thường chỉ di chuyển khi đèn xanh hoặc vàng
         elif light_state == "green":
             self.position += self.speed
         elif light_state == "yellow":
@@ -106,7 +390,7 @@ class Car:
         
         # Reset xe khi ra khỏi màn hình
         if self.position > 900:
-            self.position = random.randint(-200, -50)
+            self.position = self.rng.randint(-200, -50)
             self.passed = True
             self.waiting_time = 0
             
@@ -119,28 +403,461 @@ class Car:
             "waiting_time": self.waiting_time
         }
 
+# ==============================
+# 🗃️ KHO XE DẠNG CỘT (NUMPY)
+# ==============================
+class VehicleView:
+    # Khung nhìn dạng đối tượng vào một hàng của VehicleStore
+    __slots__ = ("store", "index")
+    
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+    
+    @property
+    def id(self):
+        return int(self.store.id[self.index])
+    
+    @property
+    def lane(self):
+        return int(self.store.lane[self.index])
+    
+    @property
+    def type(self):
+        return Car.TYPE_NAMES[self.store.type_id[self.index]]
+    
+    @property
+    def position(self):
+        return float(self.store.position[self.index])
+    
+    @property
+    def speed(self):
+        return float(self.store.speed[self.index])
+    
+    @property
+    def priority(self):
+        return int(self.store.priority[self.index])
+    
+    @property
+    def emoji(self):
+        return Car.CAR_TYPES[self.type]["emoji"]
+    
+    @property
+    def waiting_time(self):
+        return int(self.store.waiting_time[self.index])
+    
+    @property
+    def passed(self):
+        return bool(self.store.passed[self.index])
+    
+    def get_display_info(self):
+        return {
+            "id": self.id,
+            "lane": self.lane,
+            "type": self.type,
+            "position": self.position,
+            "emoji": self.emoji,
+            "waiting_time": self.waiting_time
+        }
+
+class VehicleStore:
+    # Mỗi thuộc tính xe là một mảng NumPy, xe thứ i nằm ở chỉ số i của mọi cột
+    COLUMNS = {
+        "id": np.int64,
+        "lane": np.int8,
+        "type_id": np.int8,
+        "position": np.float64,
+        "speed": np.float64,
+        "priority": np.int8,
+        "waiting_time": np.int64,
+        "passed": np.bool_
+    }
+    STOP_LINE = 350
+    PASS_LINE = 800
+    EXIT_LINE = 900
+    LANE_START = -200  # Đầu đường: xe không vào được làn khi hàng xe kéo dài tới đây
+    LANES = 4
+    MAX_TRAIL = 1_000_000  # Giới hạn số phần tử khi nhảy nhiều bước một lần
+    BASE_TICK_RATE = 2  # Tốc độ xe trong CONFIG là px/bước ở tần số này
+    TYPE_SPEEDS = np.array([Car.CAR_TYPES[name]["speed"] for name in Car.TYPE_NAMES], dtype=np.float64)
+    TYPE_PRIORITIES = np.array([Car.CAR_TYPES[name]["priority"] for name in Car.TYPE_NAMES], dtype=np.int8)
+    LIGHT_CODES = {"red": 0, "yellow": 1, "green": 2}  # Trạng thái khác (vd. đèn tắt): xe đứng yên
+    
+    def __init__(self, capacity=64):
+        self.size = 0
+        # Chế độ mạng lưới: xe ra khỏi màn hình được đưa vào danh sách này
+        # (làn, loại, quãng vượt quá vạch ra) để chuyển sang nút kế tiếp thay vì quay vòng
+        self.outflow = None
+        self.headway = CONFIG["HEADWAY"]
+        # Mỗi làn: số xe trên đường, số xe đang đứng chờ trước vạch dừng và hàng
+        # đợi ảo (loại, vị trí, bước tới) của xe tới khi làn đã đầy
+        self.lane_counts = np.zeros(self.LANES, dtype=np.int64)
+        # Số xe chưa qua vạch đích theo làn và loại, cho cảm biến tìm xe ưu tiên
+        self.unpassed_counts = np.zeros((self.LANES, len(Car.TYPE_NAMES)), dtype=np.int64)
+        self.stopped_counts = np.zeros(self.LANES, dtype=np.int64)
+        self.entry_queues = [deque() for _ in range(self.LANES)]
+        self.arrival_counts = np.zeros(self.LANES, dtype=np.int64)  # Tổng số xe đã tới mỗi làn
+        # Khi cần thống kê: danh sách (loại, số bước chờ) của các xe đã rời đường
+        self.finished = None
+        self.horizon = 64  # Số bước thử nhảy tiếp theo, thu nhỏ khi xe hay chạm nhau
+        self.links = None  # Bộ nhớ tạm của _leaders
+        # Đổi TICK_RATE chỉ làm bước mịn hơn, xe vẫn đi cùng quãng đường mỗi giây
+        self.step_scale = self.BASE_TICK_RATE / CONFIG["TICK_RATE"]
+        self.next_id = 1  # Mã xe ổn định, không dùng lại sau khi xe bị loại bỏ
+        self.tick_count = 0  # Số bước đã tính, để cộng thời gian xe nằm trong hàng đợi ảo
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+        for i in range(self.size):
+            yield VehicleView(self, i)
+    
+    def __getitem__(self, index):
+        if not -self.size <= index < self.size:
+            raise IndexError("vehicle index out of range")
+        return VehicleView(self, index % self.size)
+    
+    def _grow(self):
+        capacity = max(1, len(self.position)) * 2
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+    
+    def _push(self, lane, type_id, position, waiting_time=0):
+        if self.size == len(self.position):
+            self._grow()
+        i = self.size
+        self.id[i] = self.next_id
+        self.next_id += 1
+        self.lane[i] = lane
+        self.type_id[i] = type_id
+        self.position[i] = position
+        self.speed[i] = self.TYPE_SPEEDS[type_id]
+        self.priority[i] = self.TYPE_PRIORITIES[type_id]
+        self.waiting_time[i] = waiting_time
+        self.passed[i] = False
+        self.lane_counts[lane] += 1
+        self.unpassed_counts[lane, type_id] += 1
+        self.size += 1
+        self.links = None
+    
+    def append(self, car):
+        # Xe xếp vào hàng chờ của làn rồi lên đường ngay nếu làn còn chỗ.
+        # Trả về False nếu xe phải chờ trong hàng đợi ảo
+        self.entry_queues[car.lane].append((Car.TYPE_IDS[car.type], car.position, self.tick_count))
+        self.arrival_counts[car.lane] += 1
+        self.release_entries(car.lane)
+        return not self.entry_queues[car.lane]
+    
+    def admit(self, lane, type_id, position):
+        # Nhận nhiều xe cùng lúc (xe từ nút giao lân cận đi sang)
+        for lane, type_id, position in zip(lane.tolist(), type_id.tolist(), position.tolist()):
+            self.entry_queues[lane].append((type_id, position, self.tick_count))
+            self.arrival_counts[lane] += 1
+        for lane in range(self.LANES):
+            self.release_entries(lane)
+    
+    def _back(self, lane):
+        # Xe cuối cùng của làn (vào làn sau cùng), None nếu làn trống
+        members = np.flatnonzero(self.lane[:self.size] == lane)
+        return members[-1] if len(members) else None
+    
+    def release_entries(self, lane):
+        # Cho xe trong hàng đợi ảo lên đường khi làn có chỗ: chưa đủ MAX_CARS_PER_LANE
+        # xe và xe cuối làn đã cách đầu đường ít nhất HEADWAY. Thời gian nằm trong hàng
+        # đợi ảo được tính vào thời gian chờ của xe
+        queue = self.entry_queues[lane]
+        while queue and self.lane_counts[lane] < CONFIG["MAX_CARS_PER_LANE"]:
+            type_id, position, arrived = queue[0]
+            back = self._back(lane)
+            if back is not None:
+                position = min(position, self.position[back] - self.headway)
+                if position < self.LANE_START:
+                    break
+            queue.popleft()
+            self._push(lane, type_id, position, self.tick_count - arrived)
+    
+    def waiting_priority(self):
+        # (số xe ưu tiên chưa qua, loại ưu tiên cao nhất còn xe chưa qua, làn đầu tiên
+        # có xe loại đó); không có xe ưu tiên thì (0, None, None)
+        waiting = np.where(self.TYPE_PRIORITIES > 0, self.unpassed_counts.sum(axis=0), 0)
+        count = int(waiting.sum())
+        if not count:
+            return 0, None, None
+        type_id = int(np.argmax(np.where(waiting > 0, self.TYPE_PRIORITIES, -1)))
+        return count, type_id, int(np.argmax(self.unpassed_counts[:, type_id] > 0))
+    
+    def queue_length(self, lane):
+        # Số xe đang đứng chờ sát vạch dừng cộng số xe chưa vào được làn
+        return int(self.stopped_counts[lane]) + len(self.entry_queues[lane])
+    
+    def _leaders(self):
+        # Cặp (xe, xe ngay phía trước cùng làn). Xe vào làn theo thứ tự và không
+        # vượt nhau, nên thứ tự trong mảng của các xe cùng làn cũng là thứ tự từ
+        # đầu làn về cuối làn; chỉ cần tính lại khi có xe vào hoặc rời đường
+        if self.links is None:
+            lane = self.lane[:self.size]
+            order = np.argsort(lane, kind="stable")
+            same = lane[order[1:]] == lane[order[:-1]]
+            self.links = (order[1:][same], order[:-1][same])
+        return self.links
+    
+    def _hold(self, stopped, followers, leaders):
+        # Xe đứng sát sau (đúng HEADWAY) một xe đang đứng thì cũng đứng
+        position = self.position[:self.size]
+        if len(followers):
+            tight = position[followers] == position[leaders] - self.headway
+            while True:
+                newly = tight & stopped[leaders] & ~stopped[followers]
+                if not newly.any():
+                    break
+                stopped[followers[newly]] = True
+        return stopped
+    
+    def _light_codes(self, light_state):
+        # Mã đèn của từng xe theo đèn của làn xe đó
+        if isinstance(light_state, str):
+            light_state = [light_state] * self.LANES
+        codes = np.array([self.LIGHT_CODES.get(state, 3) for state in light_state], dtype=np.int8)
+        return codes[self.lane[:self.size]]
+    
+    def _steps(self, light_state, priority_active):
+        # Quãng đường đi trong một bước của từng xe, mặt nạ xe đang được ưu tiên,
+        # mặt nạ xe không được vượt vạch dừng và mặt nạ xe gặp đèn đỏ
+        n = self.size
+        position = self.position[:n]
+        speed = self.speed[:n]
+        codes = self._light_codes(light_state)
+        
+        step = speed.copy()
+        yellow = codes == 1
+        step[yellow] = speed[yellow] * 0.7  # Giảm tốc khi đèn vàng
+        # Đèn đỏ: chạy tới sát vạch rồi dừng, đi chậm nếu đã vượt vạch
+        red = codes == 0
+        creeping = red & (position > self.STOP_LINE)
+        step[creeping] = speed[creeping] * 0.3
+        step[codes == 3] = 0.0
+        
+        # Xe ưu tiên luôn di chuyển bất kể đèn giao thông
+        if priority_active:
+            rushing = self.priority[:n] > 0
+            step[rushing] = speed[rushing] + 5
+        else:
+            rushing = np.zeros(n, dtype=bool)
+        if self.step_scale != 1:
+            step *= self.step_scale
+        
+        walled = red & (position <= self.STOP_LINE) & ~rushing
+        return step, rushing, walled, red
+    
+    def _constrain(self, new, followers, leaders, walled):
+        # Một bước có ràng buộc: không vượt vạch dừng và cách xe trước ít nhất HEADWAY.
+        # Lặp tới khi ổn định: mỗi xe bị kéo lùi về đúng vị trí mới của xe trước - HEADWAY
+        new[walled] = np.minimum(new[walled], self.STOP_LINE)
+        while len(followers):
+            limit = new[leaders] - self.headway
+            violating = new[followers] > limit
+            if not violating.any():
+                break
+            new[followers[violating]] = limit[violating]
+        return new
+    
+    def move(self, light_state, priority_active, ticks=1):
+        # light_state: một trạng thái cho cả nút hoặc trạng thái của từng làn.
+        # Luật đèn như Car.move (trừ đèn đỏ: xe chạy tới sát vạch dừng rồi đứng) nhưng
+        # tính cho tất cả xe trong một lần, thêm bám xe: xe không vượt xe trước trong
+        # làn, giữ khoảng cách tối thiểu HEADWAY và rời đường khi ra khỏi màn hình.
+        # Trong khoảng không có xe nào chạm giới hạn (xe trước, vạch dừng) mọi xe
+        # đi đều nên nhảy nhiều bước cùng lúc; khi xe đang bám nhau thì đi từng
+        # bước nhưng chỉ tính vị trí, tới khi có xe ra khỏi màn hình
+        passed_count = 0
+        while ticks > 0 and self.size:
+            n = self.size
+            position = self.position[:n]
+            passed = self.passed[:n]
+            step, rushing, walled, red = self._steps(light_state, priority_active)
+            followers, leaders = self._leaders()
+            stopped = self._hold((step == 0) | (walled & (position == self.STOP_LINE)), followers, leaders)
+            step[stopped] = 0.0
+            
+            # Làn có xe chờ vào: dừng ngay bước xe cuối làn nhường đủ chỗ
+            backs = [self._back(lane) for lane, queue in enumerate(self.entry_queues)
+                     if queue and self.lane_counts[lane] < CONFIG["MAX_CARS_PER_LANE"]]
+            backs = np.array([back for back in backs if back is not None], dtype=np.int64)
+            
+            moving = step > 0
+            if moving.any():
+                until_exit = int(max(1, np.ceil((self.EXIT_LINE - position[moving]) / step[moving] - 1e-9).min()))
+                jump = min(ticks, until_exit, max(1, self.MAX_TRAIL // n), self.horizon)
+                blocked = None
+                if jump > 1:
+                    # Cộng dồn tuần tự từng bước (không nhân) để vị trí trùng khớp
+                    # từng bit với khi chạy từng bước một
+                    trail = np.empty((jump + 1, n))
+                    trail[0] = position
+                    trail[1:] = step
+                    trail = np.add.accumulate(trail, axis=0)[1:]
+                    
+                    # Bước đầu tiên có xe chạm giới hạn thì dừng trước bước đó
+                    blocked = (trail[:, walled] > self.STOP_LINE).any(axis=1)
+                    if len(followers):
+                        blocked |= (trail[:, followers] > trail[:, leaders] - self.headway).any(axis=1)
+                    room = (trail[:, backs] - self.headway >= self.LANE_START).any(axis=1)
+                    blocked[1:] |= room[:-1]
+                
+                if blocked is not None and not blocked[0]:
+                    if blocked.any():
+                        jump = int(np.argmax(blocked))
+                    position[:] = trail[jump - 1]
+                    self.horizon = jump * 2
+                else:
+                    # Từng bước có ràng buộc (một bước đơn lẻ cũng đi đường này)
+                    jump = min(ticks, until_exit)
+                    for k in range(jump):
+                        position[:] = self._constrain(position + step, followers, leaders, walled)
+                        if len(backs) and (position[backs] - self.headway >= self.LANE_START).any():
+                            jump = k + 1
+                            break
+                    self.horizon = 2
+            else:
+                jump = ticks
+            
+            self.waiting_time[:n][red & ~rushing] += jump
+            self.tick_count += jump
+            
+            # Đếm xe vừa qua vạch đích
+            crossed = (position > self.PASS_LINE) & ~passed
+            passed |= crossed
+            crossed_count = int(np.count_nonzero(crossed))
+            if crossed_count:
+                passed_count += crossed_count
+                types = len(Car.TYPE_NAMES)
+                cells = self.lane[:n][crossed].astype(np.int64) * types + self.type_id[:n][crossed]
+                self.unpassed_counts -= np.bincount(cells, minlength=self.LANES * types).reshape(self.LANES, types)
+            
+            # Xe ra khỏi màn hình rời làn; trong mạng lưới xe chuyển sang nút kế tiếp
+            exited = np.flatnonzero(position >= self.EXIT_LINE)
+            if len(exited):
+                if self.outflow is not None:
+                    self.outflow.append((self.lane[exited], self.type_id[exited], position[exited] - self.EXIT_LINE))
+                if self.finished is not None:
+                    self.finished.append((self.type_id[exited], self.waiting_time[exited]))
+                self.remove_exited()
+                for lane, queue in enumerate(self.entry_queues):
+                    if queue:
+                        self.release_entries(lane)
+            elif len(backs):
+                for lane in np.unique(self.lane[backs]):
+                    self.release_entries(int(lane))
+            ticks -= jump
+        self.tick_count += ticks  # Đường trống: không còn xe nào, hàng đợi ảo cũng trống
+        
+        # Độ dài hàng xe đứng sát vạch dừng của từng làn sau bước cuối
+        n = self.size
+        at_line = (self.position[:n] == self.STOP_LINE) & (self._light_codes(light_state) != 2)
+        if at_line.any():
+            queued = self._hold(at_line, *self._leaders())
+            self.stopped_counts = np.bincount(self.lane[:n][queued], minlength=self.LANES)
+        else:
+            self.stopped_counts[:] = 0
+        return passed_count
+    
+    def checkpoint_state(self):
+        # (mảng NumPy, phần còn lại dạng JSON) cho điểm lưu
+        arrays = {f"cars.{name}": getattr(self, name)[:self.size] for name in self.COLUMNS}
+        for name in ("lane_counts", "unpassed_counts", "stopped_counts", "arrival_counts"):
+            arrays[f"cars.{name}"] = getattr(self, name)
+        meta = {
+            "next_id": self.next_id,
+            "horizon": self.horizon,
+            "tick_count": self.tick_count,
+            "entry_queues": [list(queue) for queue in self.entry_queues]
+        }
+        return arrays, meta
+    
+    def restore_state(self, arrays, meta):
+        self.size = len(arrays["cars.id"])
+        for name, dtype in self.COLUMNS.items():
+            column = np.zeros(max(64, self.size * 2), dtype=dtype)
+            column[:self.size] = arrays[f"cars.{name}"]
+            setattr(self, name, column)
+        for name in ("lane_counts", "unpassed_counts", "stopped_counts", "arrival_counts"):
+            setattr(self, name, arrays[f"cars.{name}"].copy())
+        self.next_id = meta["next_id"]
+        self.horizon = meta["horizon"]
+        self.tick_count = meta["tick_count"]
+        self.entry_queues = [deque(tuple(entry) for entry in queue) for queue in meta["entry_queues"]]
+        self.links = None
+    
+    def remove_exited(self):
+        n = self.size
+        keep = (self.position[:n] < self.EXIT_LINE) | ~self.passed[:n]
+        if keep.all():
+            return
+        kept = int(np.count_nonzero(keep))
+        self.lane_counts -= np.bincount(self.lane[:n][~keep], minlength=self.LANES)
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column[:kept] = column[:n][keep]
+        self.size = kept
+        self.links = None
+
 # ==============================
 # 🚦 LỚP ĐÈN GIAO THÔNG THÔNG MINH
 # ==============================
+def lane_states_for(lanes, state):
+    # Trạng thái từng làn khi các làn `lanes` ở `state`, các làn khác đỏ
+    return tuple(state if lane in lanes else "red" for lane in range(VehicleStore.LANES))
+
+def check_conflicts(lane_states):
+    # Hai làn xung đột không được cùng đi (xanh hoặc vàng)
+    open_lanes = [lane for lane, state in enumerate(lane_states) if state != "red"]
+    for i in open_lanes:
+        for j in open_lanes:
+            if CONFIG["LANE_CONFLICTS"][i][j]:
+                raise ValueError(f"Làn {i + 1} và làn {j + 1} xung đột nhưng cùng được đi: {lane_states}")
+
+def green_seconds(plan, lane):
+    # Tổng thời gian xanh của một làn trong kế hoạch pha
+    return sum(duration for state, duration in plan
+               if (state if isinstance(state, str) else state[lane]) == "green")
+
 class SmartTrafficLight:
-    def __init__(self):
-        self.state = "red"
+    def __init__(self, clock=None):
+        self.clock = clock or WallClock()
+        self.state = "red"  # Tóm tắt: xanh nếu có làn xanh, vàng nếu có làn vàng
+        self.lane_states = ["red"] * VehicleStore.LANES
         self.timer = 0
-        self.start_time = time.time()
+        self.start_time = self.clock.now()
         self.priority_active = False
         self.priority_type = "none"
         self.priority_end_time = 0
         self.cycle_count = 0
         self.total_vehicles_passed = 0
+        self.priority_activations = 0
+        self.quiet = False  # Không ghi log đổi pha/ưu tiên (môi trường huấn luyện đổi pha mỗi bước)
         
     def set_state(self, state, duration):
-        self.state = state
+        # state: một trạng thái cho cả bốn làn hoặc bộ trạng thái của từng làn
+        if isinstance(state, str):
+            self.lane_states = [state] * VehicleStore.LANES
+            label = state.upper()
+        else:
+            self.lane_states = list(state)
+            label = "/".join(lane_state.upper() for lane_state in state)
+        self.state = next((summary for summary in ("green", "yellow") if summary in self.lane_states), self.lane_states[0])
         self.timer = duration
-        self.start_time = time.time()
-        logger.log(f"Đèn chuyển sang {state.upper()} trong {duration} giây")
+        self.start_time = self.clock.now()
+        if not self.quiet:
+            logger.log("Đèn chuyển sang %s trong %s giây", "INFO", label, duration)
         
     def time_left(self):
-        elapsed = time.time() - self.start_time
+        elapsed = self.clock.now() - self.start_time
         return max(0, self.timer - elapsed)
     
     def is_done(self):
@@ -149,978 +866,229 @@ class SmartTrafficLight:
     def activate_priority(self, priority_type, duration=10):
         self.priority_active = True
         self.priority_type = priority_type
-        self.priority_end_time = time.time() + duration
-        logger.log(f"🚨 Kích hoạt ưu tiên: {priority_type.upper()} trong {duration} giây", "PRIORITY")
+        self.priority_end_time = self.clock.now() + duration
+        self.priority_activations += 1
+        if not self.quiet:
+            logger.log("🚨 Kích hoạt ưu tiên: %s trong %s giây", "PRIORITY", priority_type.upper(), duration)
     
     def update_priority(self):
-        if self.priority_active and time.time() > self.priority_end_time:
+        if self.priority_active and self.clock.now() >= self.priority_end_time:
             self.priority_active = False
             self.priority_type = "none"
-            logger.log("Kết thúc chế độ ưu tiên", "PRIORITY")
+            if not self.quiet:
+                logger.log("Kết thúc chế độ ưu tiên", "PRIORITY")
     
     def increment_cycle(self):
         self.cycle_count += 1
     
-    def vehicle_passed(self):
-        self.total_vehicles_passed += 1
+    def vehicle_passed(self, count=1):
+        self.total_vehicles_passed += count
+    
+    CHECKPOINT_FIELDS = ("state", "lane_states", "timer", "start_time", "priority_active", "priority_type",
+                         "priority_end_time", "cycle_count", "total_vehicles_passed", "priority_activations")
+    
+    def checkpoint_state(self):
+        return {name: getattr(self, name) for name in self.CHECKPOINT_FIELDS}
+    
+    def restore_state(self, state, shift=0.0):
+        # shift: độ lệch giữa đồng hồ lúc lưu và lúc khôi phục
+        for name in self.CHECKPOINT_FIELDS:
+            setattr(self, name, state[name])
+        self.start_time += shift
+        self.priority_end_time += shift
 
 # ==============================
 # 🧠 HỆ THỐNG AI CẢM BIẾN THÔNG MINH
 # ==============================
 class TrafficAISensor:
-    def __init__(self):
-        self.history = []
+    HISTORY_SIZE = 10  # Số chu kỳ giữ trong lịch sử
+    
+    def __init__(self, clock=None):
+        self.clock = clock or WallClock()
+        self.history = deque(maxlen=self.HISTORY_SIZE)
+        # Tổng trượt trên lịch sử: lưu lượng tới đọc ra ngay, không duyệt lại
+        self.history_arrivals = [0] * VehicleStore.LANES
+        self.history_duration = 0.0
+        self.last_arrivals = [0] * VehicleStore.LANES
+        self.last_scan_time = self.clock.now()
         self.priority_vehicles_detected = 0
         
+    @profiled("scan_traffic")
     def scan_traffic(self, cars, current_cycle):
-# Phân tích mật độ xe theo làn
-        lane_counts = {0: 0, 1: 0, 2: 0, 3: 0}
-        emergency_vehicles = []
-        
-        for car in cars:
-            lane_counts[car.lane] += 1
-            if car.priority > 0 and not car.passed:
-                emergency_vehicles.append(car)
+        # Đọc bộ đếm VehicleStore cập nhật sẵn khi xe vào làn, qua vạch và rời
+        # đường, nên chi phí quét không phụ thuộc số xe
+        lane_counts = dict(enumerate(cars.lane_counts.tolist()))
         
-        # Xác định phương tiện ưu tiên
+        # Xác định phương tiện ưu tiên: loại có mức ưu tiên cao nhất còn xe chưa qua
+        # và làn đầu tiên có xe loại đó
         priority_type = "none"
-        if emergency_vehicles:
-            highest_priority = max(emergency_vehicles, key=lambda x: x.priority)
-            priority_type = highest_priority.type
+        emergency_count, type_id, priority_lane = cars.waiting_priority()
+        if emergency_count:
+            priority_type = Car.TYPE_NAMES[type_id]
             self.priority_vehicles_detected += 1
         
         # Tính toán mật độ tổng thể
         total_vehicles = sum(lane_counts.values())
         
-        # Phân tích lịch sử để dự đoán
+        # Số xe tới mỗi làn kể từ lần quét trước
+        now = self.clock.now()
+        arrivals_total = cars.arrival_counts.tolist()
+        arrivals = [count - last for count, last in zip(arrivals_total, self.last_arrivals)]
+        duration = now - self.last_scan_time
+        self.last_arrivals, self.last_scan_time = arrivals_total, now
+        
+        # Phân tích lịch sử để dự đoán; deque tự bỏ chu kỳ cũ nhất khi đầy
+        if len(self.history) == self.history.maxlen:
+            oldest = self.history[0]
+            self.history_duration -= oldest["duration"]
+            for lane in range(VehicleStore.LANES):
+                self.history_arrivals[lane] -= oldest["arrivals"][lane]
         self.history.append({
             "cycle": current_cycle,
             "lane_counts": lane_counts.copy(),
             "total": total_vehicles,
             "priority": priority_type,
-            "timestamp": time.time()
+            "arrivals": arrivals,
+            "duration": duration,
+            "timestamp": now
         })
-        
-        # Giữ lịch sử tối đa 10 cycles
-        if len(self.history) > 10:
-            self.history.pop(0)
+        self.history_duration += duration
+        for lane in range(VehicleStore.LANES):
+            self.history_arrivals[lane] += arrivals[lane]
         
         # Tạo báo cáo
         density_level = "RẤT ÍT" if total_vehicles < 5 else "ÍT" if total_vehicles < 10 else "TRUNG BÌNH" if total_vehicles < 15 else "NHIỀU" if total_vehicles < 20 else "RẤT NHIỀU"
         
-        logger.log(f"AI Scan: L1={lane_counts[0]}, L2={lane_counts[1]}, L3={lane_counts[2]}, L4={lane_counts[3]}, "
-                  f"Tổng={total_vehicles} ({density_level}), Ưu tiên={priority_type}")
+        logger.log("AI Scan: L1=%s, L2=%s, L3=%s, L4=%s, Tổng=%s (%s), Ưu tiên=%s", "INFO",
+                   lane_counts[0], lane_counts[1], lane_counts[2], lane_counts[3],
+                   total_vehicles, density_level, priority_type)
         
         return {
             "lane_counts": lane_counts,
             "total": total_vehicles,
             "priority": priority_type,
+            "priority_lane": priority_lane,
             "density_level": density_level,
-            "emergency_count": len(emergency_vehicles)
-        }
-
-# ==============================
-# 🧮 THUẬT TOÁN QUYẾT ĐỊNH THỜI GIAN ĐÈN
-# ==============================
-class LightDecisionAlgorithm:
-    def __init__(self):
-        self.base_times = {
-            "red": CONFIG["LIGHT_MIN"],
-            "green": CONFIG["LIGHT_MIN"], 
-            "yellow": CONFIG["YELLOW_MIN"]
+            "emergency_count": emergency_count,
+            "queue_lengths": [cars.queue_length(lane) for lane in range(VehicleStore.LANES)],
+            "arrival_rates": self.arrival_rates()
         }
     
-    def calculate_light_times(self, traffic_data, current_cycle):
-        priority = traffic_data["priority"]
-        total_vehicles = traffic_data["total"]
-        lane_counts = traffic_data["lane_counts"]
-        
-        # ƯU TIÊN CAO: Xe khẩn cấp
-        if priority != "none":
-            red_time = 15  # Thời gian đỏ ngắn
-            green_time = min(23, CONFIG["LIGHT_MAX"] + 2)  # Thời gian xanh dài hơn
-            yellow_time = CONFIG["YELLOW_MAX"]
-            logger.log(f"Chế độ ưu tiên: Đỏ={red_time}s, Xanh={green_time}s", "PRIORITY")
-            return red_time, green_time, yellow_time
-        
-        # ĐIỀU CHỈNH THEO MẬT ĐỘ
-        base_green = CONFIG["LIGHT_MIN"]
-        
-        if total_vehicles > 15:
-            green_time = min(CONFIG["LIGHT_MAX"], base_green + 8)
-        elif total_vehicles > 10:
-            green_time = min(CONFIG["LIGHT_MAX"], base_green + 5)
-        elif total_vehicles > 5:
-            green_time = min(CONFIG["LIGHT_MAX"], base_green + 3)
-        else:
-            green_time = base_green
-        
-        # Điều chỉnh theo chu kỳ
-        if current_cycle > 5:
-            green_time = min(green_time + 2, CONFIG["LIGHT_MAX"])
-        
-        red_time = max(CONFIG["LIGHT_MIN"], green_time - 2)
-        yellow_time = random.randint(CONFIG["YELLOW_MIN"], CONFIG["YELLOW_MAX"])
-        
-        logger.log(f"Điều chỉnh đèn: Đỏ={red_time}s, Xanh={green_time}s, Vàng={yellow_time}s")
-        return red_time, green_time, yellow_time
-
-# ==============================
-# 🛣️ LỚP QUẢN LÝ GIAO THÔNG
-# ==============================
-class TrafficManager:
-    def __init__(self):
-        self.cars = []
-        self.light = SmartTrafficLight()
-        self.sensor = TrafficAISensor()
-        self.decision_algorithm = LightDecisionAlgorithm()
-        self.last_spawn_time = time.time()
-        self.spawn_interval = 2  # giây
-        
-    def spawn_cars(self):
-        current_time = time.time()
-        if current_time - self.last_spawn_time < self.spawn_interval:
-            return
-        
-        self.last_spawn_time = current_time
-        
-        # Kiểm tra số lượng xe hiện tại
-        current_car_count = len(self.cars)
-        if current_car_count >= CONFIG["MAX_CARS_PER_LANE"] * 4:
-            return
-        
-        # Xác suất sinh xe mới
-        if random.random() < CONFIG["CAR_SPAWN_PROB"]:
-            lane = random.randint(0, 3)
-            
-            # Xác định loại xe
-            rand_val = random.random()
-            if rand_val < CONFIG["EMERGENCY_PROB"]:
-                car_type = "emergency"
-            elif rand_val < CONFIG["EMERGENCY_PROB"] + CONFIG["POLICE_PROB"]:
-                car_type = "police" 
-            elif rand_val < CONFIG["EMERGENCY_PROB"] + CONFIG["POLICE_PROB"] + CONFIG["FIRE_PROB"]:
-                car_type = "fire"
-            elif rand_val < 0.8:  # 30% còn lại cho xe thường
-                car_type = random.choice(["normal", "truck", "bus"])
-            else:
-                car_type = "normal"
-            
-            new_car = Car(lane, car_type)
-            self.cars.append(new_car)
+    def arrival_rates(self):
+        # Lưu lượng xe tới trung bình (xe/giây) của từng làn trên cửa sổ lịch sử
+        if self.history_duration <= 0:
+            return [0.0] * VehicleStore.LANES
+        return [count / self.history_duration for count in self.history_arrivals]
     
-    def update_cars(self):
-        # Di chuyển tất cả xe
-        for car in self.cars:
-            car.move(self.light.state, self.light.priority_active)
-            
-            # Đếm xe đã qua
-            if car.position > 800 and not car.passed:
-                car.passed = True
-                self.light.vehicle_passed()
-        
-        # Loại bỏ xe đã ra khỏi màn hình quá lâu
-        self.cars = [car for car in self.cars if car.position < 900 or not car.passed]
+    CHECKPOINT_FIELDS = ("history_arrivals", "history_duration", "last_arrivals", "last_scan_time",
+                         "priority_vehicles_detected")
     
-    def run_cycle(self, cycle_number):
-        logger.log(f"🚦 Bắt đầu chu kỳ {cycle_number}", "CYCLE")
-        
-        # Quét giao thông
-        traffic_data = self.sensor.scan_traffic(self.cars, cycle_number)
-        
-        # Quyết định thời gian đèn
-        red_time, green_time, yellow_time = self.decision_algorithm.calculate_light_times(
-            traffic_data, cycle_number
-        )
-        
-        # Kích hoạt ưu tiên nếu có
-        if traffic_data["priority"] != "none":
-            self.light.activate_priority(traffic_data["priority"], green_time + 2)
-        
-        # Chu kỳ đèn: ĐỎ -> XANH -> VÀNG
-        light_sequence = [
-            ("red", red_time),
-            ("green", green_time), 
-            ("yellow", yellow_time)
-        ]
-        
-        for state, duration in light_sequence:
-            self.light.set_state(state, duration)
-            
-            start_state_time = time.time()
-            while time.time() - start_state_time < duration:
-                # Cập nhật trạng thái ưu tiên
-                self.light.update_priority()
-                
-                # Sinh xe mới
-                self.spawn_cars()
-                
-                # Cập nhật vị trí xe
-                self.update_cars()
-                
-                # Ghi dữ liệu JSON
-                self.write_simulation_data(cycle_number)
-                
-                time.sleep(0.5)  # 2 FPS
-            
-            logger.log(f"Kết thúc {state.upper()} chu kỳ {cycle_number}")
-        
-        self.light.increment_cycle()
+    def checkpoint_state(self):
+        state = {name: getattr(self, name) for name in self.CHECKPOINT_FIELDS}
+        state["history"] = list(self.history)
+        return state
     
-    def write_simulation_data(self, current_cycle):
-        data = {
-            "light_state": self.light.state,
-            "cars": [car.get_display_info() for car in self.cars],
-            "current_cycle": current_cycle,
-            "max_cycles": CONFIG["MAX_CYCLES"],
-            "remaining_time": self.light.time_left(),
-            "priority_type": self.light.priority_type,
-            "priority_active": self.light.priority_active,
-            "total_vehicles_passed": self.light.total_vehicles_passed,
-            "log": logger.get_recent_logs(10)
-        }
-        
-        with open("traffic_data.json", "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    def restore_state(self, state, shift=0.0):
+        for name in self.CHECKPOINT_FIELDS:
+            setattr(self, name, state[name])
+        self.last_scan_time += shift
+        self.history.clear()
+        for entry in state["history"]:
+            # JSON đổi khóa số thành chuỗi
+            entry["lane_counts"] = {int(lane): count for lane, count in entry["lane_counts"].items()}
+            entry["timestamp"] += shift
+            self.history.append(entry)
 
 # ==============================
-# 🌐 GIAO DIỆN WEB NÂNG CAO
+# 🎛️ BỘ ĐIỀU KHIỂN ĐÈN (PLUGIN)
 # ==============================
-HTML_CONTENT = """<!DOCTYPE html>
-<html lang="vi">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>🚦 Hệ Thống Đèn Giao Thông Thông Minh AI</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-            color: #333;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            padding: 30px;
-            box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-            backdrop-filter: blur(10px);
-        }
-        
-        header {
-            text-align: center;
-            margin-bottom: 30px;
-            padding-bottom: 20px;
-            border-bottom: 3px solid #eee;
-        }
-        
-        h1 {
-            color: #2c3e50;
-            font-size: 2.5em;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.1);
-        }
-        
-        .subtitle {
-            color: #7f8c8d;
-            font-size: 1.2em;
-            font-weight: 300;
-        }
-        
-        .simulation-area {
-            display: grid;
-            grid-template-columns: 2fr 1fr;
-            gap: 30px;
-            margin-bottom: 30px;
-        }
-        
-        @media (max-width: 768px) {
-            .simulation-area {
-                grid-template-columns: 1fr;
-            }
-        }
-        
-        .traffic-canvas-container {
-            background: #2c3e50;
-            border-radius: 15px;
-            padding: 20px;
-            box-shadow: inset 0 0 20px rgba(0, 0, 0, 0.3);
-        }
-        
-        #trafficCanvas {
-            width: 100%;
-            height: 500px;
-            background: #34495e;
-            border-radius: 10px;
-            display: block;
-        }
-        
-        .control-panel {
-            background: #ecf0f1;
-            border-radius: 15px;
-            padding: 25px;
-            box-shadow: 0 10px 25px rgba(0, 0, 0, 0.1);
-        }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 15px;
-            margin-bottom: 25px;
-        }
-        
-        .stat-card {
-            background: white;
-            padding: 15px;
-            border-radius: 10px;
-            text-align: center;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.08);
-            transition: transform 0.3s ease;
-        }
-        
-        .stat-card:hover {
-            transform: translateY(-5px);
-        }
-        
-        .stat-value {
-            font-size: 1.8em;
-            font-weight: bold;
-            color: #2c3e50;
-            margin: 5px 0;
-        }
-        
-        .stat-label {
-            font-size: 0.9em;
-            color: #7f8c8d;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-        }
-        
-        .light-indicator {
-            text-align: center;
-            margin: 20px 0;
-            padding: 20px;
-            background: white;
-            border-radius: 15px;
-            box-shadow: 0 10px 25px rgba(0, 0, 0, 0.1);
-        }
-        
-        .light-state {
-            font-size: 2em;
-            font-weight: bold;
-            margin: 10px 0;
-            text-transform: uppercase;
-        }
-        
-        .state-red { color: #e74c3c; }
-.state-green { color: #27ae60; }
-        .state-yellow { color: #f39c12; }
-        
-        .timer {
-            font-size: 3em;
-            font-weight: bold;
-            color: #2c3e50;
-            margin: 10px 0;
-        }
-        
-        .priority-alert {
-            background: linear-gradient(135deg, #ff6b6b, #ee5a24);
-            color: white;
-            padding: 15px;
-            border-radius: 10px;
-            text-align: center;
-            margin: 15px 0;
-            animation: pulse 2s infinite;
-        }
-        
-        @keyframes pulse {
-            0% { transform: scale(1); }
-            50% { transform: scale(1.05); }
-            100% { transform: scale(1); }
-        }
-        
-        .log-container {
-            background: #2c3e50;
-            border-radius: 15px;
-            padding: 20px;
-            color: white;
-        }
-        
-        #log {
-            height: 200px;
-            overflow-y: auto;
-            font-family: 'Courier New', monospace;
-            font-size: 0.9em;
-            line-height: 1.4;
-            background: #1a252f;
-            padding: 15px;
-            border-radius: 10px;
-            margin-top: 10px;
-        }
-        
-        .log-entry {
-            margin-bottom: 5px;
-            padding: 3px 0;
-            border-bottom: 1px solid #34495e;
-        }
-        
-        .log-time {
-            color: #3498db;
-        }
-        
-        .log-priority {
-            color: #e74c3c;
-            font-weight: bold;
-        }
-        
-        .lane-info {
-            display: flex;
-            justify-content: space-between;
-            margin-top: 10px;
-            font-size: 0.8em;
-            color: #bdc3c7;
-        }
-        
-        .road-markings {
-            position: absolute;
-            width: 100%;
-            height: 100%;
-            pointer-events: none;
-        }
-        
-        .road-line {
-            position: absolute;
-            background: white;
-            opacity: 0.8;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <header>
-            <h1>🚦 Hệ Thống Đèn Giao Thông Thông Minh AI</h1>
-            <div class="subtitle">Edge Computing & Artificial Intelligence trong quản lý giao thông đô thị</div>
-        </header>
-        
-        <div class="simulation-area">
-            <div class="traffic-canvas-container">
-                <canvas id="trafficCanvas" width="800" height="500"></canvas>
-            </div>
-            
-            <div class="control-panel">
-                <div class="stats-grid">
-                    <div class="stat-card">
-                        <div class="stat-label">Chu Kỳ Hiện Tại</div>
-                        <div class="stat-value" id="cycle">1</div>
-                        <div class="stat-label">/<span id="maxCycle">10</span></div>
-                    </div>
-                    
-                    <div class="stat-card">
-<div class="stat-label">Xe Đã Qua</div>
-                        <div class="stat-value" id="vehiclesPassed">0</div>
-                        <div class="stat-label">Phương Tiện</div>
-                    </div>
-                </div>
-                
-                <div class="light-indicator">
-                    <div class="stat-label">Trạng Thái Đèn</div>
-                    <div class="light-state" id="stateDisplay">ĐỎ</div>
-                    <div class="timer" id="timer">0.0s</div>
-                    <div class="stat-label">Thời Gian Còn Lại</div>
-                </div>
-                
-                <div id="priorityDisplay" style="display: none;">
-                    <div class="priority-alert">
-                        <div style="font-size: 1.5em;">🚨 ƯU TIÊN KHẨN CẤP</div>
-                        <div id="priorityType" style="font-size: 1.2em; margin-top: 5px;"></div>
-                    </div>
-                </div>
-            </div>
-        </div>
-        
-        <div class="log-container">
-            <div style="display: flex; justify-content: between; align-items: center; margin-bottom: 10px;">
-                <h3 style="color: white;">📋 Nhật Ký Hệ Thống</h3>
-                <button onclick="clearLog()" style="background: #e74c3c; color: white; border: none; padding: 5px 10px; border-radius: 5px; cursor: pointer;">Xóa Log</button>
-            </div>
-            <div id="log"></div>
-        </div>
-    </div>
-
-    <script>
-        const canvas = document.getElementById('trafficCanvas');
-        const ctx = canvas.getContext('2d');
-        
-        // Kích thước thực tế của canvas
-        const canvasWidth = 800;
-        const canvasHeight = 500;
-        
-        // Thiết lập kích thước hiển thị
-        canvas.width = canvasWidth;
-        canvas.height = canvasHeight;
-        
-        // Biến toàn cục
-        let simulationData = {};
-        
-        // Vẽ đường và làn xe
-        function drawRoad() {
-            // Mặt đường
-            ctx.fillStyle = '#34495e';
-            ctx.fillRect(0, 0, canvasWidth, canvasHeight);
-            
-            // Vẽ vạch kẻ đường giữa (loại bỏ vạch trên cùng)
-            ctx.strokeStyle = 'white';
-            ctx.lineWidth = 2;
-            ctx.setLineDash([10, 15]);
-            
-            // Chỉ vẽ 2 vạch phân cách giữa các làn (thay vì 3)
-            for (let i = 1; i <= 2; i++) {
-                const y = (canvasHeight / 3) * i;
-                ctx.beginPath();
-                ctx.moveTo(0, y);
-                ctx.lineTo(canvasWidth, y);
-                ctx.stroke();
-            }
-            
-            ctx.setLineDash([]);
-            
-            // Vẽ vạch dừng
-            ctx.strokeStyle = 'white';
-            ctx.lineWidth = 3;
-            ctx.beginPath();
-            ctx.moveTo(350, 0);
-            ctx.lineTo(350, canvasHeight);
-            ctx.stroke();
-// Vẽ biển báo dừng
-            ctx.fillStyle = 'red';
-            ctx.font = '12px Arial';
-            ctx.fillText('VẠCH DỪNG', 360, canvasHeight / 2);
-        }
-        
-        // Vẽ đèn giao thông
-        function drawTrafficLight(state) {
-            const lightX = 700;
-            const lightY = 50;
-            const lightWidth = 80;
-            const lightHeight = 200;
-            
-            // Thân đèn
-            ctx.fillStyle = '#2c3e50';
-            ctx.fillRect(lightX, lightY, lightWidth, lightHeight);
-            ctx.fillStyle = '#34495e';
-            ctx.fillRect(lightX - 10, lightY + lightHeight, 100, 20);
-            
-            // Đèn
-            const lights = [
-                { color: '#e74c3c', state: 'red', y: lightY + 20 },
-                { color: '#f39c12', state: 'yellow', y: lightY + 80 },
-                { color: '#27ae60', state: 'green', y: lightY + 140 }
-            ];
-            
-            lights.forEach(light => {
-                ctx.beginPath();
-                ctx.arc(lightX + lightWidth/2, light.y, 25, 0, Math.PI * 2);
-                ctx.fillStyle = light.state === state ? light.color : '#7f8c8d';
-                ctx.fill();
-                ctx.strokeStyle = '#2c3e50';
-                ctx.lineWidth = 2;
-                ctx.stroke();
-            });
-        }
-        
-        // Vẽ xe
-        function drawCars(cars) {
-            cars.forEach(car => {
-                const x = car.position;
-                const laneHeight = canvasHeight / 4;
-                const y = 50 + (car.lane * laneHeight);
-                
-                // Vẽ xe bằng emoji
-                ctx.font = '30px Arial';
-                ctx.fillText(car.emoji, x, y);
-                
-                // Hiển thị thời gian chờ nếu xe đang dừng
-                if (car.waiting_time > 30) {
-                    ctx.fillStyle = 'red';
-                    ctx.font = '12px Arial';
-                    ctx.fillText(`${car.waiting_time}s`, x, y - 10);
-                }
-            });
-        }
-        
-        // Cập nhật giao diện
-        function updateDisplay(data) {
-            document.getElementById('cycle').textContent = data.current_cycle;
-            document.getElementById('maxCycle').textContent = data.max_cycles;
-            document.getElementById('vehiclesPassed').textContent = data.total_vehicles_passed || 0;
-            
-            // Cập nhật trạng thái đèn
-            const stateDisplay = document.getElementById('stateDisplay');
-            stateDisplay.textContent = data.light_state.toUpperCase();
-            stateDisplay.className = 'light-state state-' + data.light_state;
-            
-            // Cập nhật timer
-            document.getElementById('timer').textContent = data.remaining_time.toFixed(1) + 's';
-            
-            // Cập nhật ưu tiên
-            const priorityDisplay = document.getElementById('priorityDisplay');
-if (data.priority_active) {
-                priorityDisplay.style.display = 'block';
-                document.getElementById('priorityType').textContent = 
-                    data.priority_type.toUpperCase() + ' ƯU TIÊN';
-            } else {
-                priorityDisplay.style.display = 'none';
-            }
-            
-            // Cập nhật log
-            const logElement = document.getElementById('log');
-            logElement.innerHTML = data.log.map(entry => 
-                `<div class="log-entry"><span class="log-time">${entry.substring(1, 9)}</span> ${entry.substring(12)}</div>`
-            ).join('');
-            logElement.scrollTop = logElement.scrollHeight;
-        }
-        
-        // Vẽ toàn bộ cảnh
-        function drawScene(data) {
-            // Xóa canvas
-            ctx.clearRect(0, 0, canvasWidth, canvasHeight);
-            
-            // Vẽ các thành phần
-            drawRoad();
-            drawTrafficLight(data.light_state);
-            drawCars(data.cars);
-        }
-        
-        // Lấy dữ liệu từ server
-        async function fetchData() {
-            try {
-                const response = await fetch('traffic_data.json?t=' + new Date().getTime());
-                simulationData = await response.json();
-                updateDisplay(simulationData);
-                drawScene(simulationData);
-            } catch (error) {
-                console.error('Lỗi khi tải dữ liệu:', error);
-            }
-        }
-        
-        // Xóa log
-        function clearLog() {
-            const logElement = document.getElementById('log');
-            logElement.innerHTML = '';
-        }
-        
-        // Bắt đầu cập nhật
-        setInterval(fetchData, 500);
-        fetchData();
-    </script>
-</body>
-</html>"""
-
-# ==============================
-# 🕹️ WEB SERVER
-# ==============================
-class TrafficHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def log_message(self, format, *args):
-        # Tắt log mặc định của HTTP server
-        pass
-
-def start_web_server():
-    # Tạo file HTML
-    with open(HTML_FILE, "w", encoding="utf-8") as f:
-        f.write(HTML_CONTENT)
-    
-    # Khởi động server
-    PORT = 8000
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    
-    with socketserver.TCPServer(("", PORT), TrafficHTTPRequestHandler) as httpd:
-        print(f"🌐 Server đang chạy tại: http://localhost:{PORT}")
-        print("🔄 Đang khởi động mô phỏng giao thông...")
-        webbrowser.open(f"http://localhost:{PORT}/{HTML_FILE}")
-        
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\n⏹️ Dừng server...")
-
-# ==============================
-# 🚀 CHƯƠNG TRÌNH CHÍNH
-# ==============================
-def main():
-    print("=" * 60)
-    print("🚦 HỆ THỐNG ĐÈN GIAO THÔNG THÔNG MINH AI")
-    print("   Sử dụng Edge Computing & Artificial Intelligence")
-print("=" * 60)
-    
-    # Xóa log cũ
-if os.path.exists(CONFIG["LOG_FILE"]):
-        os.remove(CONFIG["LOG_FILE"])
-    
-    # Khởi tạo hệ thống
-        traffic_manager = TrafficManager()
-    
-def run_simulation():
-        logger.log("🎬 Bắt đầu mô phỏng hệ thống đèn giao thông thông minh", "SYSTEM")
-        
-        try:
-            for cycle in range(1, CONFIG["MAX_CYCLES"] + 1):
-                traffic_manager.run_cycle(cycle)
-                
-                # Nghỉ giữa các chu kỳ
-                if cycle < CONFIG["MAX_CYCLES"]:
-                    time.sleep(2)
-            
-            logger.log("✅ Mô phỏng hoàn tất! Tổng số xe đã qua: " + 
-                      str(traffic_manager.light.total_vehicles_passed), "SYSTEM")
-                      
-        except Exception as e:
-            logger.log(f"❌ Lỗi trong mô phỏng: {str(e)}", "ERROR")
-    
-    # Chạy mô phỏng trong thread riêng
-sim_thread = threading.Thread(target=run_simulation, daemon=True)
-sim_thread.start()
-    
-    # Khởi động web server
-start_web_server()
-
-
-if __name__ == "__main__":
-    main()
-import random
-import time
-import json
-import os
-from datetime import datetime
-import threading
-import http.server
-import socketserver
-import webbrowser
-
-# ==============================
-# ⚙️ CẤU HÌNH NÂNG CAO
-# ==============================
-CONFIG = {
-    "LANE1_MAX": 15,
-    "LANE2_MAX": 15,
-    "LANE3_MAX": 15,
-    "LANE4_MAX": 15,
-    "EMERGENCY_PROB": 0.15,
-    "POLICE_PROB": 0.08,
-    "FIRE_PROB": 0.07,
-    "LIGHT_MIN": 8,
-    "LIGHT_MAX": 15,
-    "YELLOW_MIN": 3,
-    "YELLOW_MAX": 5,
-    "MAX_CYCLES": 10,
-    "SCALE_FACTOR": 1.2,
-    "LOG_FILE": "traffic_log.txt",
-    "CAR_SPEED_NORMAL": 8,
-    "CAR_SPEED_EMERGENCY": 15,
-    "CAR_SPEED_SLOW": 5,
-    "MAX_CARS_PER_LANE": 8,
-    "CAR_SPAWN_PROB": 0.3
-}
-
-HTML_FILE = "traffic_simulation.html"
-
-# ==============================
-# 📜 HỆ THỐNG LOG NÂNG CAO
-# ==============================
-class TrafficLogger:
-    def __init__(self, log_file):
-        self.log_file = log_file
-        self.entries = []
-        
-    def log(self, message, level="INFO"):
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] [{level}] {message}"
-        print(log_entry)
-        
-        # Thêm vào bộ nhớ
-        self.entries.append(log_entry)
-        
-        # Ghi vào file
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry + "\n")
-        
-        return log_entry
-    
-    def get_recent_logs(self, count=15):
-        return self.entries[-count:] if self.entries else []
-
-# Khởi tạo logger
-logger = TrafficLogger(CONFIG["LOG_FILE"])
-
-# ==============================
-# 🚗 LỚP XE NÂNG CAO
-# ==============================
-class Car:
-    CAR_TYPES = {
-        "normal": {"emoji": "🚘", "speed": CONFIG["CAR_SPEED_NORMAL"], "priority": 0},
-"emergency": {"emoji": "🚑", "speed": CONFIG["CAR_SPEED_EMERGENCY"], "priority": 3},
-        "police": {"emoji": "🚓", "speed": CONFIG["CAR_SPEED_EMERGENCY"], "priority": 2},
-        "fire": {"emoji": "🚒", "speed": CONFIG["CAR_SPEED_EMERGENCY"], "priority": 1},
-        "truck": {"emoji": "🚚", "speed": CONFIG["CAR_SPEED_SLOW"], "priority": 0},
-        "bus": {"emoji": "🚌", "speed": CONFIG["CAR_SPEED_SLOW"], "priority": 0}
-    }
-    
-    def __init__(self, lane, car_type="normal"):
-        self.lane = lane
-        self.type = car_type
-        self.position = random.randint(-100, -20)  # Xuất hiện từ ngoài màn hình
-        self.speed = self.CAR_TYPES[car_type]["speed"]
-        self.priority = self.CAR_TYPES[car_type]["priority"]
-        self.emoji = self.CAR_TYPES[car_type]["emoji"]
-        self.waiting_time = 0
-        self.passed = False
-        
-    def move(self, light_state, priority_active):
-        # Xe ưu tiên luôn di chuyển bất kể đèn giao thông
-        if self.priority > 0 and priority_active:
-            self.position += self.speed + 5  # Tăng tốc khi có ưu tiên
-        # Xe thường chỉ di chuyển khi đèn xanh hoặc vàng
-        elif light_state == "green":
-            self.position += self.speed
-        elif light_state == "yellow":
-            self.position += self.speed * 0.7  # Giảm tốc khi đèn vàng
-        elif light_state == "red":
-            # Đèn đỏ - xe dừng lại
-            self.waiting_time += 1
-            # Chỉ cho phép di chuyển nếu đã vượt quá vạch dừng (position > 350)
-            if self.position < 350:  # Vạch dừng ở giữa đường
-                self.position += 0  # Dừng hoàn toàn
-            else:
-                self.position += self.speed * 0.3  # Đi chậm nếu đã vượt vạch
-        
-        # Reset xe khi ra khỏi màn hình
-        if self.position > 900:
-            self.position = random.randint(-200, -50)
-            self.passed = True
-            self.waiting_time = 0
-            
-    def get_display_info(self):
-        return {
-            "lane": self.lane,
-            "type": self.type,
-            "position": self.position,
-            "emoji": self.emoji,
-            "waiting_time": self.waiting_time
-        }
-
-# ==============================
-# 🚦 LỚP ĐÈN GIAO THÔNG THÔNG MINH
-# ==============================
-class SmartTrafficLight:
-    def __init__(self):
-        self.state = "red"
-        self.timer = 0
-        self.start_time = time.time()
-        self.priority_active = False
-        self.priority_type = "none"
-        self.priority_end_time = 0
-        self.cycle_count = 0
-        self.total_vehicles_passed = 0
-        
-    def set_state(self, state, duration):
-        self.state = state
-        self.timer = duration
-        self.start_time = time.time()
-        logger.log(f"Đèn chuyển sang {state.upper()} trong {duration} giây")
-        
-    def time_left(self):
-        elapsed = time.time() - self.start_time
-        return max(0, self.timer - elapsed)
-    
-    def is_done(self):
-        return self.time_left() <= 0
-    
-    def activate_priority(self, priority_type, duration=10):
-        self.priority_active = True
-        self.priority_type = priority_type
-        self.priority_end_time = time.time() + duration
-        logger.log(f"🚨 Kích hoạt ưu tiên: {priority_type.upper()} trong {duration} giây", "PRIORITY")
-    
-    def update_priority(self):
-        if self.priority_active and time.time() > self.priority_end_time:
-            self.priority_active = False
-            self.priority_type = "none"
-            logger.log("Kết thúc chế độ ưu tiên", "PRIORITY")
-    
-    def increment_cycle(self):
-        self.cycle_count += 1
+# Bộ điều khiển nhận kết quả quét của cảm biến (số xe, hàng chờ, lưu lượng tới
+# theo làn), lịch sử các lần quét và số chu kỳ, trả về kế hoạch pha của chu kỳ:
+# [(trạng thái đèn, số giây), ...] chạy lần lượt. Trạng thái là một chuỗi cho cả
+# nút hoặc bộ trạng thái của từng làn, kiểm tra với CONFIG["LANE_CONFLICTS"].
+# Chọn bằng CONFIG["CONTROLLER"] hoặc --controller: tên trong CONTROLLERS hoặc
+# "module:TênLớp" của bộ ngoài.
+class LightController:
+    rng = random  # TrafficManager gán bộ sinh số ngẫu nhiên riêng của nút giao
     
-    def vehicle_passed(self):
-        self.total_vehicles_passed += 1
-
-# ==============================
-# 🧠 HỆ THỐNG AI CẢM BIẾN THÔNG MINH
-# ==============================
-class TrafficAISensor:
-    def __init__(self):
-        self.history = []
-        self.priority_vehicles_detected = 0
-        
-    def scan_traffic(self, cars, current_cycle):
-        # Phân tích mật độ xe theo làn
-        lane_counts = {0: 0, 1: 0, 2: 0, 3: 0}
-        emergency_vehicles = []
-        
-        for car in cars:
-            lane_counts[car.lane] += 1
-            if car.priority > 0 and not car.passed:
-                emergency_vehicles.append(car)
-        
-        # Xác định phương tiện ưu tiên
-        priority_type = "none"
-        if emergency_vehicles:
-            highest_priority = max(emergency_vehicles, key=lambda x: x.priority)
-            priority_type = highest_priority.type
-            self.priority_vehicles_detected += 1
-        
-        # Tính toán mật độ tổng thể
-        total_vehicles = sum(lane_counts.values())
-        
-        # Phân tích lịch sử để dự đoán
-        self.history.append({
-            "cycle": current_cycle,
-            "lane_counts": lane_counts.copy(),
-            "total": total_vehicles,
-            "priority": priority_type,
-            "timestamp": time.time()
-        })
-        
-        # Giữ lịch sử tối đa 10 cycles
-        if len(self.history) > 10:
-            self.history.pop(0)
-        
-        # Tạo báo cáo
-        density_level = "RẤT ÍT" if total_vehicles < 5 else "ÍT" if total_vehicles < 10 else "TRUNG BÌNH" if total_vehicles < 15 else "NHIỀU" if total_vehicles < 20 else "RẤT NHIỀU"
-        
-        logger.log(f"AI Scan: L1={lane_counts[0]}, L2={lane_counts[1]}, L3={lane_counts[2]}, L4={lane_counts[3]}, "
-                  f"Tổng={total_vehicles} ({density_level}), Ưu tiên={priority_type}")
-        
-        return {
-            "lane_counts": lane_counts,
-            "total": total_vehicles,
-            "priority": priority_type,
-            "density_level": density_level,
-            "emergency_count": len(emergency_vehicles)
-        }
+    def plan(self, traffic_data, history, current_cycle):
+        raise NotImplementedError
+    
+    @staticmethod
+    def stages():
+        # Các nhóm làn cùng được đèn xanh, theo thứ tự pha trong CONFIG["SIGNAL_PHASES"]
+        return [tuple(lanes) for _, lanes in CONFIG["SIGNAL_PHASES"]]
+    
+    def build_plan(self, greens, yellow=None, order=None):
+        # Mỗi pha: xanh rồi vàng cho các làn của pha, các làn khác đỏ.
+        # order: thứ tự chạy các pha (mặc định theo SIGNAL_PHASES)
+        stages = self.stages()
+        yellow = yellow or CONFIG["YELLOW_MIN"]
+        plan = []
+        for index in order or range(len(stages)):
+            plan.append((lane_states_for(stages[index], "green"), greens[index]))
+            plan.append((lane_states_for(stages[index], "yellow"), yellow))
+        return plan
+    
+    def lost_time(self):
+        # Thời gian mỗi chu kỳ không nhóm làn nào được xanh (đèn vàng cuối mỗi pha)
+        return CONFIG["YELLOW_MIN"] * len(self.stages())
+    
+    @staticmethod
+    def saturation_flow():
+        # Số xe/giây một làn xả được khi xanh: xe thường nối đuôi nhau cách HEADWAY
+        return CONFIG["CAR_SPEED_NORMAL"] * VehicleStore.BASE_TICK_RATE / CONFIG["HEADWAY"]
+    
+    @staticmethod
+    def clamp_green(seconds):
+        return int(round(min(max(seconds, CONFIG["LIGHT_MIN"]), CONFIG["MAX_GREEN"])))
+
+class FixedTimeController(LightController):
+    # Thời gian cố định, không phụ thuộc giao thông: mốc để so sánh
+    def __init__(self, green=None):
+        self.green = green or (CONFIG["LIGHT_MIN"] + CONFIG["LIGHT_MAX"]) // 2
+    
+    def plan(self, traffic_data, history, current_cycle):
+        return self.build_plan([self.green] * len(self.stages()))
+
+class WebsterController(LightController):
+    # Chu kỳ tối ưu Webster: C0 = (1.5L + 5) / (1 - Y), với L là thời gian mất mỗi
+    # chu kỳ và Y tổng tỉ số lưu lượng/lưu lượng bão hòa của làn tới hạn từng nhóm;
+    # thời gian xanh hiệu dụng C0 - L chia theo tỉ số của từng nhóm
+    MAX_Y = 0.9  # Gần bão hòa thì công thức tiến ra vô cùng, chặn lại
+    
+    def plan(self, traffic_data, history, current_cycle):
+        rates = traffic_data["arrival_rates"]
+        flow = self.saturation_flow()
+        stages = self.stages()
+        ratios = [max(rates[lane] for lane in lanes) / flow for lanes in stages]
+        total = min(sum(ratios), self.MAX_Y)
+        lost = self.lost_time()
+        cycle = (1.5 * lost + 5) / (1 - total)
+        if total <= 0:
+            return self.build_plan([self.clamp_green((cycle - lost) / len(stages))] * len(stages))
+        return self.build_plan([self.clamp_green((cycle - lost) * ratio / total) for ratio in ratios])
+
+class MaxPressureController(LightController):
+    # Max-pressure theo chu kỳ: áp lực của làn là xe chờ trước nút trừ xe chờ ở nút
+    # phía sau; các làn trong nhóm xả song song nên nhóm được xanh đủ lâu để xả
+    # làn áp lực lớn nhất ở lưu lượng bão hòa, nhóm áp lực lớn hơn được đi trước.
+    # Nút đơn lẻ coi hàng phía sau bằng 0
+    def plan(self, traffic_data, history, current_cycle):
+        queues = traffic_data["queue_lengths"]
+        downstream = traffic_data.get("downstream_queues", [0] * len(queues))
+        flow = self.saturation_flow()
+        pressures = [max(max(queues[lane] - downstream[lane], 0) for lane in lanes) for lanes in self.stages()]
+        greens = [self.clamp_green(pressure / flow) for pressure in pressures]
+        order = sorted(range(len(pressures)), key=lambda index: -pressures[index])
+        return self.build_plan(greens, order=order)
 
 # ==============================
 # 🧮 THUẬT TOÁN QUYẾT ĐỊNH THỜI GIAN ĐÈN
 # ==============================
-class LightDecisionAlgorithm:
+class LightDecisionAlgorithm(LightController):
+    # Bộ điều khiển mặc định: bậc thang theo tổng số xe, mỗi pha cùng thời gian xanh;
+    # chế độ ưu tiên cho pha có xe ưu tiên đi trước
     def __init__(self):
         self.base_times = {
             "red": CONFIG["LIGHT_MIN"],
@@ -1128,27 +1096,29 @@ class LightDecisionAlgorithm:
             "yellow": CONFIG["YELLOW_MIN"]
         }
     
+    @profiled("calculate_light_times")
     def calculate_light_times(self, traffic_data, current_cycle):
         priority = traffic_data["priority"]
         total_vehicles = traffic_data["total"]
         lane_counts = traffic_data["lane_counts"]
         
         # ƯU TIÊN CAO: Xe khẩn cấp
+        # (thời gian đỏ của mỗi làn là xanh + vàng của các pha khác, không tính riêng)
         if priority != "none":
-            red_time = 2  # Thời gian đỏ ngắn
             green_time = min(12, CONFIG["LIGHT_MAX"] + 2)  # Thời gian xanh dài hơn
             yellow_time = CONFIG["YELLOW_MAX"]
-            logger.log(f"Chế độ ưu tiên: Đỏ={red_time}s, Xanh={green_time}s", "PRIORITY")
-            return red_time, green_time, yellow_time
+            logger.log("Chế độ ưu tiên: Xanh=%ss, Vàng=%ss", "PRIORITY", green_time, yellow_time)
+            return green_time, yellow_time
         
         # ĐIỀU CHỈNH THEO MẬT ĐỘ
         base_green = CONFIG["LIGHT_MIN"]
         
-        if total_vehicles > 15:
+        low, medium, high = CONFIG["DENSITY_THRESHOLDS"]
+        if total_vehicles > high:
             green_time = min(CONFIG["LIGHT_MAX"], base_green + 8)
-        elif total_vehicles > 10:
+        elif total_vehicles > medium:
             green_time = min(CONFIG["LIGHT_MAX"], base_green + 5)
-        elif total_vehicles > 5:
+        elif total_vehicles > low:
             green_time = min(CONFIG["LIGHT_MAX"], base_green + 3)
         else:
             green_time = base_green
@@ -1157,128 +1127,1509 @@ class LightDecisionAlgorithm:
         if current_cycle > 5:
             green_time = min(green_time + 2, CONFIG["LIGHT_MAX"])
         
-        red_time = max(CONFIG["LIGHT_MIN"], green_time - 2)
-        yellow_time = random.randint(CONFIG["YELLOW_MIN"], CONFIG["YELLOW_MAX"])
+        yellow_time = self.rng.randint(CONFIG["YELLOW_MIN"], CONFIG["YELLOW_MAX"])
         
-        logger.log(f"Điều chỉnh đèn: Đỏ={red_time}s, Xanh={green_time}s, Vàng={yellow_time}s")
-        return red_time, green_time, yellow_time
+        logger.log("Điều chỉnh đèn: Xanh=%ss, Vàng=%ss", "INFO", green_time, yellow_time)
+        return green_time, yellow_time
+    
+    def plan(self, traffic_data, history, current_cycle):
+        green_time, yellow_time = self.calculate_light_times(traffic_data, current_cycle)
+        stages = self.stages()
+        order = list(range(len(stages)))
+        lane = traffic_data.get("priority_lane")
+        if lane is not None:
+            order.sort(key=lambda index: lane not in stages[index])
+        return self.build_plan([green_time] * len(stages), yellow_time, order)
+
+CONTROLLERS = {
+    "ladder": LightDecisionAlgorithm,
+    "fixed": FixedTimeController,
+    "webster": WebsterController,
+    "max_pressure": MaxPressureController
+}
+
+def create_controller(name=None):
+    # "webster" -> lớp có sẵn; "goi.module:TenLop" -> nạp lớp từ module ngoài
+    name = name or CONFIG["CONTROLLER"]
+    if ":" in name:
+        import importlib
+        module_name, _, class_name = name.partition(":")
+        controller_class = getattr(importlib.import_module(module_name), class_name)
+    elif name in CONTROLLERS:
+        controller_class = CONTROLLERS[name]
+    else:
+        raise ValueError(f"Không có bộ điều khiển '{name}' (có: {', '.join(CONTROLLERS)})")
+    return controller_class()
+
+# ==============================
+# 📡 ẢNH CHỤP TRẠNG THÁI TRONG BỘ NHỚ
+# ==============================
+# Khung trạng thái gửi cho dashboard:
+#   "key":   đầy đủ - bảng loại xe, mọi xe [id, làn, loại, vị trí, thời gian chờ], 10 dòng log
+#   "delta": chỉ phần đổi so với khung trước - xe mới, xe di chuyển [id, vị trí,
+#            thời gian chờ], mã xe bị loại bỏ và các dòng log mới
+# Các giá trị đơn lẻ (đèn, chu kỳ, bộ đếm...) có mặt trong mọi khung.
+FRAME_SCALARS = (
+    "light_state", "current_cycle", "max_cycles", "remaining_time",
+    "priority_type", "priority_active", "total_vehicles_passed", "lane_states"
+)
+
+class FrameEncoder:
+    # Chạy trên luồng mô phỏng: so sánh kho xe với khung trước bằng mảng NumPy
+    def __init__(self, keyframe_interval=None):
+        self.keyframe_interval = keyframe_interval or CONFIG["KEYFRAME_INTERVAL"]
+        self.count = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.position = np.empty(0)
+        self.waiting_time = np.empty(0, dtype=np.int64)
+        self.log_seq = 0
+    
+    def encode(self, scalars, store):
+        n = store.size
+        ids = store.id[:n].copy()
+        position = np.round(store.position[:n], 1)
+        waiting_time = store.waiting_time[:n].copy()
+        
+        frame = dict(scalars)
+        if self.count % self.keyframe_interval == 0:
+            frame["type"] = "key"
+            frame["types"] = {
+                i: [name, Car.CAR_TYPES[name]["emoji"]] for i, name in enumerate(Car.TYPE_NAMES)
+            }
+            frame["cars"] = list(zip(
+                ids.tolist(), store.lane[:n].tolist(), store.type_id[:n].tolist(),
+                position.tolist(), waiting_time.tolist()
+            ))
+            self.log_seq, _ = logger.get_logs_since(self.log_seq)
+            frame["log"] = logger.get_recent_logs(10)
+        else:
+            # Mã xe luôn tăng dần trong kho nên so khớp hai khung bằng intersect1d
+            _, prev_index, index = np.intersect1d(
+                self.ids, ids, assume_unique=True, return_indices=True
+            )
+            created = np.ones(n, dtype=bool)
+            created[index] = False
+            removed = np.ones(len(self.ids), dtype=bool)
+            removed[prev_index] = False
+            changed = (position[index] != self.position[prev_index]) | \
+                      (waiting_time[index] != self.waiting_time[prev_index])
+            moved = index[changed]
+            
+            frame["type"] = "delta"
+            frame["created"] = list(zip(
+                ids[created].tolist(), store.lane[:n][created].tolist(),
+                store.type_id[:n][created].tolist(), position[created].tolist(),
+                waiting_time[created].tolist()
+            ))
+            frame["moved"] = list(zip(
+                ids[moved].tolist(), position[moved].tolist(), waiting_time[moved].tolist()
+            ))
+            frame["removed"] = self.ids[removed].tolist()
+            self.log_seq, frame["log"] = logger.get_logs_since(self.log_seq)
+        
+        self.count += 1
+        self.ids, self.position, self.waiting_time = ids, position, waiting_time
+        return frame
+
+class StateSnapshot:
+    # Giữ một dãy khung gần nhất cho luồng SSE và dựng lại trạng thái đầy đủ
+    # (định dạng cũ) khi có người gọi /api/state. Bản đầy đủ dùng bộ đệm kép:
+    # dựng vào ô phụ rồi đổi ô chính, người đọc không bao giờ thấy bản ghi dở
+    def __init__(self, history=None):
+        self.frames = deque(maxlen=history or 2 * CONFIG["KEYFRAME_INTERVAL"] + 1)
+        self.keyframe_seq = 0
+        self.version = 0
+        # Mã riêng của tiến trình, ghép vào id sự kiện SSE: trình duyệt kết nối lại với
+        # Last-Event-ID của server trước (đã khởi động lại) sẽ nhận lại khung đầy đủ
+        self.stream_id = os.urandom(4).hex()
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        
+        self.buffers = [b"{}", b"{}"]
+        self.front = 0
+        self.built_version = 0
+        self.types = {}
+        self.cars = {}
+        self.log = deque(maxlen=10)
+        self.scalars = {}
+    
+    def publish(self, frame):
+        with self.lock:
+            seq = self.version + 1
+            frame["seq"] = seq
+            body = json.dumps(frame, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.frames.append((seq, frame, body))
+            if frame["type"] == "key":
+                self.keyframe_seq = seq
+            self.version = seq
+            self.updated.notify_all()
+        return body
+    
+    def _frames_after(self, seen_version):
+        # Các khung người xem còn thiếu; nếu đã bị đẩy khỏi hàng đợi thì bắt đầu
+        # lại từ khung đầy đủ gần nhất
+        oldest = self.frames[0][0]
+        start = seen_version + 1 if seen_version and seen_version + 1 >= oldest else self.keyframe_seq
+        return [entry for entry in itertools.islice(self.frames, start - oldest, None)]
+    
+    def wait_for_frames(self, seen_version, timeout=None):
+        # Chờ tới khi có khung mới hơn seen_version; trả None nếu hết thời gian
+        with self.lock:
+            if seen_version > self.version:
+                # Số thứ tự không thuộc dãy này: bắt đầu lại từ khung đầy đủ
+                seen_version = 0
+            if not self.updated.wait_for(lambda: self.version > seen_version, timeout):
+                return None
+            return [(seq, body) for seq, _, body in self._frames_after(seen_version)]
+    
+    def _apply(self, frame):
+        if frame["type"] == "key":
+            self.types = frame["types"]
+            self.cars = {row[0]: list(row[1:]) for row in frame["cars"]}
+            self.log.clear()
+        else:
+            for row in frame["created"]:
+                self.cars[row[0]] = list(row[1:])
+            for vehicle_id, position, waiting_time in frame["moved"]:
+                self.cars[vehicle_id][2:] = [position, waiting_time]
+            for vehicle_id in frame["removed"]:
+                self.cars.pop(vehicle_id, None)
+        self.log.extend(frame["log"])
+        self.scalars = {key: frame[key] for key in FRAME_SCALARS}
+    
+    def read(self):
+        with self.lock:
+            if self.built_version != self.version:
+                for _, frame, _ in self._frames_after(self.built_version):
+                    self._apply(frame)
+                data = dict(self.scalars)
+                data["cars"] = [
+                    {
+                        "id": vehicle_id,
+                        "lane": lane,
+                        "type": self.types[type_id][0],
+                        "position": position,
+                        "emoji": self.types[type_id][1],
+                        "waiting_time": waiting_time
+                    }
+                    for vehicle_id, (lane, type_id, position, waiting_time) in self.cars.items()
+                ]
+                data["log"] = list(self.log)
+                back = 1 - self.front
+                self.buffers[back] = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.front = back
+                self.built_version = self.version
+            return self.version, self.buffers[self.front]
+
+# Trạng thái dùng chung giữa luồng mô phỏng và web server
+state_snapshot = StateSnapshot()
+
+def write_file_atomic(path, body):
+    # Ghi ra file tạm rồi thay thế, người đọc file không thấy bản ghi dở
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
 
 # ==============================
 # 🛣️ LỚP QUẢN LÝ GIAO THÔNG
 # ==============================
 class TrafficManager:
-    def __init__(self):
-        self.cars = []
-        self.light = SmartTrafficLight()
-        self.sensor = TrafficAISensor()
-        self.decision_algorithm = LightDecisionAlgorithm()
-        self.last_spawn_time = time.time()
+    def __init__(self, clock=None, write_data=True, seed=None):
+        # clock: WallClock cho dashboard, VirtualClock cho chạy headless
+        self.clock = clock or WallClock()
+        self.write_data = write_data
+        # Bộ sinh số ngẫu nhiên riêng của nút giao, không phụ thuộc nút giao khác. Không
+        # có seed thì lấy hạt giống từ random toàn cục, nên random.seed(...) trước đó vẫn
+        # có tác dụng. Hai dòng tách biệt: rng cho xe tới (thời điểm, làn, loại, vị trí),
+        # control_rng cho bộ điều khiển (thời gian vàng). Nhờ vậy cùng seed thì cùng dãy
+        # xe tới dù tham số đèn khác nhau (số ngẫu nhiên chung khi so sánh trong tune)
+        seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(seed)
+        self.control_rng = random.Random(f"{seed}:control")
+        self.event_log = None  # EventLog khi cần ghi lại lần chạy để phát lại
+        self.digest = None  # Mã băm trạng thái sau mỗi chu kỳ khi ghi hoặc phát lại
+        self.trace = None  # TraceRecorder khi ghi vết từng bước
+        self.cars = VehicleStore()
+        self.frame_encoder = FrameEncoder()
+        self.light = SmartTrafficLight(self.clock)
+        self.sensor = TrafficAISensor(self.clock)
+        self.decision_algorithm = create_controller()
+        self.decision_algorithm.rng = self.control_rng
+        self.last_spawn_time = self.clock.now()
         self.spawn_interval = 2  # giây
         
-    def spawn_cars(self):
-        current_time = time.time()
-        if current_time - self.last_spawn_time < self.spawn_interval:
-            return
-        
-        self.last_spawn_time = current_time
-        
-        # Kiểm tra số lượng xe hiện tại
-        current_car_count = len(self.cars)
-        if current_car_count >= CONFIG["MAX_CARS_PER_LANE"] * 4:
-            return
-        
-        # Xác suất sinh xe mới
-        if random.random() < CONFIG["CAR_SPAWN_PROB"]:
-            lane = random.randint(0, 3)
-            
-            # Xác định loại xe
-            rand_val = random.random()
-            if rand_val < CONFIG["EMERGENCY_PROB"]:
-                car_type = "emergency"
-            elif rand_val < CONFIG["EMERGENCY_PROB"] + CONFIG["POLICE_PROB"]:
-                    car_type = "police" 
-            elif rand_val < CONFIG["EMERGENCY_PROB"] + CONFIG["POLICE_PROB"] + CONFIG["FIRE_PROB"]:
-                car_type = "fire"
-            elif rand_val < 0.8:  # 30% còn lại cho xe thường
-                car_type = random.choice(["normal", "truck", "bus"])
-            else: 
-                car_type = "normal"
-            
-            new_car = Car(lane, car_type)
-            self.cars.append(new_car)
+        # Vòng lặp sự kiện: bước xe chỉ được tính khi có sự kiện cần tới
+        self.scheduler = EventScheduler()
+        self.schedule_spawn(self.last_spawn_time)
+        self.tick = 1 / CONFIG["TICK_RATE"]
+        self.current_cycle = 0
+        self.cycle_running = False
+        self.moving = False  # Xe chỉ đi trong các pha đèn, đứng yên giữa hai chu kỳ
+        self.phase_start = self.phase_end = self.last_spawn_time
+        self.tick_index = 0  # Số bước đã tính kể từ đầu pha hiện tại
+        # Bước trễ hạn quá một bước (bỏ phần công bố để đuổi kịp): tổng, trong chu kỳ này
+        self.overruns = 0
+        self.cycle_overruns = 0
+        self.max_lateness = 0.0
+        
+    def next_spawn_time(self, after):
+        # Mỗi spawn_interval giây có xác suất CAR_SPAWN_PROB sinh xe: rút trước các
+        # lần thử tới lần thành công để lên lịch thẳng tới lúc xe tới
+        if CONFIG["CAR_SPAWN_PROB"] <= 0:
+            return None
+        at = after + self.spawn_interval
+        while self.rng.random() >= CONFIG["CAR_SPAWN_PROB"]:
+            at += self.spawn_interval
+        return at
     
-    def update_cars(self):
-        # Di chuyển tất cả xe
-        for car in self.cars:
-            car.move(self.light.state, self.light.priority_active)
-            
-            # Đếm xe đã qua
-            if car.position > 800 and not car.passed:
-                car.passed = True
-                self.light.vehicle_passed()
+    def schedule_spawn(self, after):
+        at = self.next_spawn_time(after)
+        if at is not None:
+            self.scheduler.push(at, "spawn")
+    
+    @profiled("spawn_cars")
+    def spawn_cars(self, spawn=None):
+        # Được gọi khi có xe tới (sự kiện "spawn"); `spawn` là bản ghi trong nhật ký
+        # khi phát lại (xem ReplayTrafficManager)
+        self.last_spawn_time = self.clock.now()
+        
+        lane = self.rng.randint(0, 3)
+        
+        # Xác định loại xe
+        rand_val = self.rng.random()
+        if rand_val < CONFIG["EMERGENCY_PROB"]:
+            car_type = "emergency"
+        elif rand_val < CONFIG["EMERGENCY_PROB"] + CONFIG["POLICE_PROB"]:
+            car_type = "police"
+        elif rand_val < CONFIG["EMERGENCY_PROB"] + CONFIG["POLICE_PROB"] + CONFIG["FIRE_PROB"]:
+            car_type = "fire"
+        elif rand_val < 0.8:  # 30% còn lại cho xe thường
+            car_type = self.rng.choice(["normal", "truck", "bus"])
+        else:
+            car_type = "normal"
         
-        # Loại bỏ xe đã ra khỏi màn hình quá lâu
-        self.cars = [car for car in self.cars if car.position < 900 or not car.passed]
+        # Làn đầy thì xe chờ trong hàng đợi ảo của làn tới khi có chỗ
+        new_car = Car(lane, car_type, self.rng)
+        if self.event_log is not None:
+            self.event_log.record("spawn", self.last_spawn_time, lane, car_type, new_car.position)
+        self.cars.append(new_car)
     
-    def run_cycle(self, cycle_number):
-        logger.log(f"🚦 Bắt đầu chu kỳ {cycle_number}", "CYCLE")
+    @profiled("update_cars")
+    def update_cars(self, ticks=1):
+        # Di chuyển tất cả xe và đếm xe đã qua
+        # (xe đã ra khỏi màn hình quá lâu được loại bỏ ngay trong VehicleStore.move)
+        passed = self.cars.move(self.light.lane_states, self.light.priority_active, ticks)
+        if passed:
+            self.light.vehicle_passed(passed)
+    
+    def start_cycle(self, cycle_number):
+        logger.log("🚦 Bắt đầu chu kỳ %s", "CYCLE", cycle_number)
+        self.current_cycle = cycle_number
         
         # Quét giao thông
         traffic_data = self.sensor.scan_traffic(self.cars, cycle_number)
         
-        # Quyết định thời gian đèn
-        red_time, green_time, yellow_time = self.decision_algorithm.calculate_light_times(
-            traffic_data, cycle_number
-        )
+        # Bộ điều khiển quyết định kế hoạch pha, vd. XANH Đông-Tây -> VÀNG -> XANH Bắc-Nam...
+        light_sequence = self.decision_algorithm.plan(traffic_data, self.sensor.history, cycle_number)
+        # Trạng thái dạng chuỗi áp cho cả bốn làn nên cũng phải qua ma trận xung đột
+        for state, _ in light_sequence:
+            if isinstance(state, str):
+                state = lane_states_for(range(VehicleStore.LANES), state)
+            check_conflicts(state)
         
-        # Kích hoạt ưu tiên nếu có
+        # Kích hoạt ưu tiên nếu có, đủ lâu cho thời gian xanh của làn có xe ưu tiên
+        priority_duration = None
         if traffic_data["priority"] != "none":
-            self.light.activate_priority(traffic_data["priority"], green_time + 2)
-        
-        # Chu kỳ đèn: ĐỎ -> XANH -> VÀNG
-        light_sequence = [
-            ("red", red_time),
-            ("green", green_time), 
-            ("yellow", yellow_time)
-        ]
+            priority_duration = green_seconds(light_sequence, traffic_data["priority_lane"]) + 2
+        if self.event_log is not None:
+            self.event_log.record("cycle", self.clock.now(), cycle_number, light_sequence,
+                                  traffic_data["priority"], priority_duration)
+        self.apply_plan(light_sequence, traffic_data["priority"], priority_duration)
+    
+    def apply_plan(self, light_sequence, priority, priority_duration):
+        # Lên lịch các pha của chu kỳ hiện tại từ bây giờ
+        if priority_duration is not None:
+            self.light.activate_priority(priority, priority_duration)
+            self.scheduler.push(self.light.priority_end_time, "priority_end")
         
+        at = self.clock.now()
         for state, duration in light_sequence:
-            self.light.set_state(state, duration)
-            
-            start_state_time = time.time()
-            while time.time() - start_state_time < duration:
-                # Cập nhật trạng thái ưu tiên
-                self.light.update_priority()
-                
-                # Sinh xe mới
-                self.spawn_cars()
-                
-                # Cập nhật vị trí xe
-                self.update_cars()
-                
-                # Ghi dữ liệu JSON
-                self.write_simulation_data(cycle_number)
-                
-                time.sleep(0.5)  # 2 FPS
-            
-            logger.log(f"Kết thúc {state.upper()} chu kỳ {cycle_number}")
+            self.scheduler.push(at, "phase", (state, duration))
+            at += duration
+        self.scheduler.push(at, "cycle_end", self.current_cycle)
+        self.cycle_running = True
+    
+    def advance_vehicles(self, until, inclusive=False):
+        # Tính dồn các bước xe của pha hiện tại có thời điểm trước `until`
+        if not self.moving:
+            return
+        if until >= self.phase_end:
+            until, inclusive = self.phase_end, False
         
-        self.light.increment_cycle()
+        span = (until - self.phase_start) / self.tick
+        if inclusive:
+            end_index = int(np.floor(span + 1e-9)) + 1
+        else:
+            end_index = int(np.ceil(span - 1e-9))
+        
+        ticks = end_index - self.tick_index
+        if ticks > 0:
+            self.update_cars(ticks)
+            self.tick_index = end_index
+    
+    def process_next_event(self):
+        at, kind, payload = self.scheduler.pop()
+        self.advance_vehicles(at, inclusive=EVENT_TYPES[kind][1])
+        self.clock.sleep_until(at)
+        
+        if kind == "phase":
+            if self.moving and not self.light.quiet:
+                logger.log("Kết thúc %s chu kỳ %s", "INFO", self.light.state.upper(), self.current_cycle)
+            state, duration = payload
+            self.light.set_state(state, duration)
+            self.phase_start, self.phase_end = at, at + duration
+            self.tick_index = 0
+            self.moving = True
+            if self.write_data or self.trace is not None:
+                self.scheduler.push(at, "render", 0)
+        
+        elif kind == "cycle_end":
+            if not self.light.quiet:
+                logger.log("Kết thúc %s chu kỳ %s", "INFO", self.light.state.upper(), payload)
+            if self.cycle_overruns:
+                logger.log("⏱️ Chu kỳ %s: %s bước trễ hạn (trễ nhất %.0fms), đã bỏ qua công bố để đuổi kịp",
+                           "WARNING", payload, self.cycle_overruns, self.max_lateness * 1000)
+                self.cycle_overruns = 0
+                self.max_lateness = 0.0
+            if self.digest is not None:
+                update_digest(self.digest, self)
+            self.moving = False
+            self.cycle_running = False
+            self.light.increment_cycle()
+        
+        elif kind == "spawn":
+            # Sinh xe mới
+            self.spawn_cars(payload)
+            self.schedule_spawn(at)
+        
+        elif kind == "priority_end":
+            # Cập nhật trạng thái ưu tiên
+            self.light.update_priority()
+        
+        elif kind == "render":
+            # Ghi dữ liệu JSON mỗi bước khi có người xem, ghi vết khi được yêu cầu.
+            # Hạn của mỗi bước tính từ đầu pha nên không trôi theo thời gian xử lý; trễ
+            # quá một bước thì bỏ phần công bố (bước mô phỏng vẫn tính đủ) để đuổi kịp
+            if self.trace is not None:
+                self.trace.record(self)
+            lateness = self.clock.now() - at
+            if lateness >= self.tick:
+                self.overruns += 1
+                self.cycle_overruns += 1
+                self.max_lateness = max(self.max_lateness, lateness)
+            elif self.write_data:
+                self.write_simulation_data(self.current_cycle)
+            next_at = self.phase_start + (payload + 1) * self.tick
+            if self.moving and next_at < self.phase_end and at < self.phase_end:
+                self.scheduler.push(next_at, "render", payload + 1)
+    
+    def run_until(self, until):
+        # Xử lý mọi sự kiện tới thời điểm `until` rồi dừng đúng tại đó
+        while self.scheduler.peek_time() is not None and self.scheduler.peek_time() <= until:
+            self.process_next_event()
+        self.advance_vehicles(until)
+        self.clock.sleep_until(until)
+    
+    # ---------- Điểm lưu ----------
+    # Toàn bộ trạng thái (xe, đèn, cảm biến, hàng đợi sự kiện, bộ sinh số ngẫu nhiên)
+    # trong một file .npz nén: cột xe là mảng, phần còn lại là JSON trong mảng "meta".
+    # Bộ điều khiển có sẵn không giữ trạng thái nên chỉ cần tên trong CONFIG
+    CHECKPOINT_FIELDS = ("current_cycle", "cycle_running", "moving", "phase_start", "phase_end",
+                         "tick_index", "last_spawn_time", "spawn_interval")
+    
+    def checkpoint_bytes(self):
+        arrays, cars_meta = self.cars.checkpoint_state()
+        meta = {
+            "config": {key: value for key, value in CONFIG.items() if key not in CACHE_KEY_IGNORED},
+            "now": self.clock.now(),
+            "rng": self.rng.getstate(),
+            "control_rng": self.control_rng.getstate(),
+            "scheduler": self.scheduler.queue,
+            "manager": {name: getattr(self, name) for name in self.CHECKPOINT_FIELDS},
+            "cars": cars_meta,
+            "light": self.light.checkpoint_state(),
+            "sensor": self.sensor.checkpoint_state()
+        }
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8), **arrays)
+        return buffer.getvalue()
+    
+    def save_checkpoint(self, path):
+        # Ghi file tạm rồi thay thế: bị ngắt giữa chừng thì điểm lưu cũ vẫn nguyên vẹn
+        write_file_atomic(path, self.checkpoint_bytes())
     
-        def write_simulation_data(self, current_cycle):data = {
+    @classmethod
+    def from_checkpoint(cls, source, clock=None, write_data=True):
+        # source: đường dẫn hoặc bytes của checkpoint_bytes(). Áp CONFIG của lần chạy
+        # gốc; với WallClock mọi mốc thời gian được dời theo đồng hồ hiện tại
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        with np.load(source) as data:
+            meta = json.loads(data["meta"].tobytes())
+            arrays = {name: data[name] for name in data.files if name != "meta"}
+        # CONFIG của lần chạy gốc thắng tùy chọn dòng lệnh (--controller, --tick-rate...);
+        # báo các giá trị bị đổi. MAX_CYCLES được dòng lệnh đặt lại sau khi khôi phục
+        overridden = [key for key, value in meta["config"].items()
+                      if key != "MAX_CYCLES" and json.loads(json.dumps(CONFIG.get(key))) != value]
+        if overridden:
+            logger.log("⚠️ Điểm lưu dùng CONFIG của lần chạy gốc, bỏ qua giá trị hiện tại: " +
+                       ", ".join(f"{key} {CONFIG.get(key)!r} -> {meta['config'][key]!r}" for key in overridden),
+                       "WARNING")
+        CONFIG.update(meta["config"])
+        
+        manager = cls(clock or VirtualClock(), write_data)
+        if isinstance(manager.clock, VirtualClock):
+            manager.clock.current = meta["now"]
+            shift = 0.0
+        else:
+            shift = manager.clock.now() - meta["now"]
+        for name in ("rng", "control_rng"):
+            version, internal, gauss = meta[name]
+            getattr(manager, name).setstate((version, tuple(internal), gauss))
+        manager.scheduler.restore((at + shift, *rest) for at, *rest in meta["scheduler"])
+        for name, value in meta["manager"].items():
+            setattr(manager, name, value)
+        manager.phase_start += shift
+        manager.phase_end += shift
+        manager.last_spawn_time += shift
+        manager.cars.restore_state(arrays, meta["cars"])
+        manager.light.restore_state(meta["light"], shift)
+        manager.sensor.restore_state(meta["sensor"], shift)
+        return manager
+    
+    def fork(self):
+        # Bản sao độc lập chạy bằng đồng hồ ảo, để thử "nếu... thì" từ trạng thái đang chạy
+        return type(self).from_checkpoint(self.checkpoint_bytes(), VirtualClock(), write_data=False)
+    
+    def run_cycle(self, cycle_number):
+        self.start_cycle(cycle_number)
+        while self.cycle_running:
+            self.process_next_event()
+    
+    @profiled("write_simulation_data")
+    def write_simulation_data(self, current_cycle):
+        scalars = {
             "light_state": self.light.state,
-            "cars": [car.get_display_info() for car in self.cars],
             "current_cycle": current_cycle,
             "max_cycles": CONFIG["MAX_CYCLES"],
             "remaining_time": self.light.time_left(),
             "priority_type": self.light.priority_type,
             "priority_active": self.light.priority_active,
-"total_vehicles_passed": self.light.total_vehicles_passed,
-            "log": logger.get_recent_logs(10)
+            "total_vehicles_passed": self.light.total_vehicles_passed,
+            "lane_states": list(self.light.lane_states)
         }
+        state_snapshot.publish(self.frame_encoder.encode(scalars, self.cars))
         
-        with open("traffic_data.json", "w", encoding="utf-8") as f: 
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        # Ghi file chỉ để tương thích với công cụ cũ đọc traffic_data.json
+        if CONFIG["STATE_FILE"]:
+            _, body = state_snapshot.read()
+            write_file_atomic(CONFIG["STATE_FILE"], body)
+
+# ==============================
+# 📼 GHI VÀ PHÁT LẠI LẦN CHẠY
+# ==============================
+# Nhật ký giữ mọi thứ được rút ngẫu nhiên hoặc do bộ điều khiển quyết định: xe tới
+# ["spawn", lúc, làn, loại, vị trí] và chu kỳ ["cycle", lúc, số chu kỳ, kế hoạch pha,
+# loại ưu tiên, thời gian ưu tiên]. Phát lại chỉ tính lại chuyển động xe, không
+# rút số ngẫu nhiên, không quét cảm biến và không gọi bộ điều khiển.
+class EventLog:
+    def __init__(self, seed=None, config=None, events=None, fingerprint=None):
+        self.seed = seed
+        self.config = config if config is not None else {
+            key: value for key, value in CONFIG.items() if key not in CACHE_KEY_IGNORED}
+        self.events = events if events is not None else []
+        self.fingerprint = fingerprint  # Mã băm trạng thái cuối của lần chạy gốc
+    
+    def record(self, *event):
+        self.events.append(list(event))
+    
+    def save(self, path):
+        body = json.dumps({"seed": self.seed, "config": self.config, "events": self.events,
+                           "fingerprint": self.fingerprint}, ensure_ascii=False)
+        write_file_atomic(path, body.encode("utf-8"))
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+        return cls(data["seed"], data["config"], data["events"], data["fingerprint"])
+
+def update_digest(digest, traffic_manager):
+    # Thêm trạng thái hiện tại vào mã băm; băm sau mỗi chu kỳ nên hai lần chạy chỉ
+    # trùng mã khi khớp từng bit suốt quá trình, không chỉ ở trạng thái cuối
+    cars = traffic_manager.cars
+    for name in VehicleStore.COLUMNS:
+        digest.update(getattr(cars, name)[:cars.size].tobytes())
+    digest.update(repr((traffic_manager.light.total_vehicles_passed, traffic_manager.clock.now(),
+                        [list(queue) for queue in cars.entry_queues])).encode("utf-8"))
+
+def run_fingerprint(traffic_manager):
+    update_digest(traffic_manager.digest, traffic_manager)
+    return traffic_manager.digest.hexdigest()
+
+class ReplayTrafficManager(TrafficManager):
+    def __init__(self, event_log, clock=None, write_data=False):
+        self.cycle_records = deque(event for event in event_log.events if event[0] == "cycle")
+        super().__init__(clock or VirtualClock(), write_data, event_log.seed)
+        self.digest = hashlib.sha256()
+        for event in event_log.events:
+            if event[0] == "spawn":
+                self.scheduler.push(event[1], "spawn", event)
+    
+    def schedule_spawn(self, after):
+        # Xe tới đã được lên lịch sẵn từ nhật ký
+        pass
+    
+    def spawn_cars(self, spawn=None):
+        _, at, lane, car_type, position = spawn
+        self.last_spawn_time = at
+        new_car = Car(lane, car_type, self.rng)
+        new_car.position = position
+        self.cars.append(new_car)
+    
+    def start_cycle(self, cycle_number):
+        _, _, recorded_cycle, light_sequence, priority, priority_duration = self.cycle_records.popleft()
+        logger.log("🚦 Bắt đầu chu kỳ %s (phát lại)", "CYCLE", recorded_cycle)
+        self.current_cycle = cycle_number
+        self.apply_plan(light_sequence, priority, priority_duration)
+
+def run_replay(path):
+    # Phát lại nhật ký với CONFIG của lần chạy gốc; trả về (manager, có khớp từng bit)
+    event_log = EventLog.load(path)
+    CONFIG.update(event_log.config)
+    traffic_manager = ReplayTrafficManager(event_log)
+    run_simulation(traffic_manager, CONFIG["MAX_CYCLES"])
+    return traffic_manager, run_fingerprint(traffic_manager) == event_log.fingerprint
+
+# ==============================
+# 🎞️ VẾT TỪNG BƯỚC DẠNG CỘT
+# ==============================
+# Vết là một thư mục: meta.json và các khối CHUNK_TICKS bước, mỗi cột một file
+# <khối>_<cột>.npy. Cột theo bước (thời điểm, đèn từng làn, bộ đếm...) có một
+# hàng mỗi bước; cột theo xe nối các xe của mọi bước trong khối, "offset" cho biết
+# xe của bước bắt đầu ở đâu. Đọc bằng memory-map nên nhảy tới bước bất kỳ chỉ cần
+# tính khối và đọc hai offset.
+LIGHT_NAMES = ("red", "yellow", "green", "off")  # Theo VehicleStore.LIGHT_CODES, 3 = trạng thái khác
+
+class TraceRecorder:
+    CHUNK_TICKS = 4096
+    VEHICLE_COLUMNS = {
+        "id": np.int64,
+        "lane": np.int8,
+        "type_id": np.int8,
+        "position": np.float32,
+        "waiting_time": np.int32
+    }
+    TICK_COLUMNS = {
+        "time": np.float64,
+        "cycle": np.int32,
+        "remaining_time": np.float32,
+        "light_state": np.int8,
+        "lane_states": np.int8,  # Mỗi hàng VehicleStore.LANES mã đèn
+        "priority_type": np.int8,  # -1: không có
+        "priority_active": np.bool_,
+        "passed": np.int64,
+        "offset": np.int64
+    }
+    
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.chunks = 0
+        self.ticks = 0
+        self._clear()
+    
+    def _clear(self):
+        self.vehicles = {name: [] for name in self.VEHICLE_COLUMNS}
+        self.tick_rows = {name: [] for name in self.TICK_COLUMNS}
+        self.rows = 0
+    
+    def record(self, traffic_manager):
+        cars = traffic_manager.cars
+        light = traffic_manager.light
+        n = cars.size
+        for name in self.VEHICLE_COLUMNS:
+            self.vehicles[name].append(getattr(cars, name)[:n].copy())
+        codes = VehicleStore.LIGHT_CODES
+        row = self.tick_rows
+        row["time"].append(traffic_manager.clock.now())
+        row["cycle"].append(traffic_manager.current_cycle)
+        row["remaining_time"].append(light.time_left())
+        row["light_state"].append(codes.get(light.state, 3))
+        row["lane_states"].append([codes.get(state, 3) for state in light.lane_states])
+        row["priority_type"].append(Car.TYPE_IDS.get(light.priority_type, -1))
+        row["priority_active"].append(light.priority_active)
+        row["passed"].append(light.total_vehicles_passed)
+        row["offset"].append(self.rows)
+        self.rows += n
+        self.ticks += 1
+        if len(row["time"]) == self.CHUNK_TICKS:
+            self.flush()
+    
+    def flush(self):
+        # Ghi khối đang gom ra đĩa rồi mới cập nhật meta.json: người đọc chỉ thấy khối đầy đủ
+        if not self.tick_rows["time"]:
+            return
+        for name, dtype in self.VEHICLE_COLUMNS.items():
+            np.save(os.path.join(self.path, f"{self.chunks:05d}_{name}.npy"),
+                    np.concatenate(self.vehicles[name]).astype(dtype))
+        for name, dtype in self.TICK_COLUMNS.items():
+            np.save(os.path.join(self.path, f"{self.chunks:05d}_{name}.npy"),
+                    np.array(self.tick_rows[name], dtype=dtype))
+        self.chunks += 1
+        self._clear()
+        meta = {
+            "chunk_ticks": self.CHUNK_TICKS,
+            "chunks": self.chunks,
+            "ticks": self.ticks,
+            "tick_rate": CONFIG["TICK_RATE"],
+            "max_cycles": CONFIG["MAX_CYCLES"],
+            "types": [[name, Car.CAR_TYPES[name]["emoji"]] for name in Car.TYPE_NAMES]
+        }
+        write_file_atomic(os.path.join(self.path, "meta.json"), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+    
+    def close(self):
+        self.flush()
+
+class TraceCars:
+    # Xe của một bước trong vết, cùng các thuộc tính FrameEncoder đọc từ VehicleStore
+    def __init__(self, columns, start, end):
+        self.size = end - start
+        for name in TraceRecorder.VEHICLE_COLUMNS:
+            setattr(self, name, columns[name][start:end])
+        self.position = self.position.astype(np.float64)
+
+class TraceReader:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(os.path.join(self.path, "meta.json"), "rb") as f:
+            self.meta = json.loads(f.read())
+        self.tick_rate = self.meta["tick_rate"]
+        self.type_names = [name for name, _ in self.meta["types"]]
+        self.columns = {}  # Khối -> {cột: mảng memory-map}
+    
+    def __len__(self):
+        return self.meta["ticks"]
+    
+    def chunk(self, index):
+        if index not in self.columns:
+            self.columns[index] = {
+                name: np.load(os.path.join(self.path, f"{index:05d}_{name}.npy"), mmap_mode="r")
+                for name in (*TraceRecorder.VEHICLE_COLUMNS, *TraceRecorder.TICK_COLUMNS)
+            }
+        return self.columns[index]
+    
+    def frame(self, tick):
+        # (giá trị đơn lẻ như write_simulation_data, xe) của bước `tick`
+        if not 0 <= tick < len(self):
+            raise IndexError(f"bước {tick} ngoài vết (0..{len(self) - 1})")
+        columns = self.chunk(tick // self.meta["chunk_ticks"])
+        local = tick % self.meta["chunk_ticks"]
+        start = int(columns["offset"][local])
+        end = int(columns["offset"][local + 1]) if local + 1 < len(columns["offset"]) else len(columns["id"])
+        priority_type = int(columns["priority_type"][local])
+        scalars = {
+            "light_state": LIGHT_NAMES[columns["light_state"][local]],
+            "current_cycle": int(columns["cycle"][local]),
+            "max_cycles": self.meta["max_cycles"],
+            "remaining_time": float(columns["remaining_time"][local]),
+            "priority_type": self.type_names[priority_type] if priority_type >= 0 else "none",
+            "priority_active": bool(columns["priority_active"][local]),
+            "total_vehicles_passed": int(columns["passed"][local]),
+            "lane_states": [LIGHT_NAMES[code] for code in columns["lane_states"][local]]
+        }
+        return scalars, TraceCars(columns, start, end)
+
+class TracePlayer:
+    # Phát vết lên dashboard với tốc độ `speed` lần thời gian thực; vị trí phát tính
+    # từ đồng hồ nên tốc độ cao chỉ bỏ qua các bước ở giữa, không phải đọc chúng
+    MAX_FPS = 30
+    
+    def __init__(self, reader, speed=1.0, start=0):
+        self.reader = reader
+        self.encoder = FrameEncoder()
+        self.lock = threading.Lock()
+        self.speed = speed
+        self.start_tick = 0
+        self.started = time.monotonic()
+        self.seek(start)
+    
+    def position(self):
+        elapsed = time.monotonic() - self.started
+        tick = self.start_tick + int(elapsed * self.reader.tick_rate * self.speed)
+        return min(max(0, tick), len(self.reader) - 1)
+    
+    def seek(self, tick=None, speed=None):
+        # Nhảy tới bước `tick` và/hoặc đổi tốc độ (0 = dừng); gọi được từ luồng HTTP
+        with self.lock:
+            if tick is None:
+                tick = self.position()
+            if speed is not None:
+                self.speed = speed
+            self.start_tick = min(max(0, tick), len(self.reader) - 1)
+            self.started = time.monotonic()
+            return self.start_tick, self.speed
+    
+    def run(self):
+        shown = None
+        while True:
+            with self.lock:
+                tick = self.position()
+            if tick != shown:
+                scalars, cars = self.reader.frame(tick)
+                state_snapshot.publish(self.encoder.encode(scalars, cars))
+                shown = tick
+            time.sleep(1 / self.MAX_FPS)
+
+# ==============================
+# 🏙️ MẠNG LƯỚI NHIỀU NÚT GIAO
+# ==============================
+# Lưới rows x cols nút giao, mỗi nút là một TrafficManager. Xe ra khỏi làn 0, 1
+# đi sang nút bên phải, làn 2, 3 đi xuống nút bên dưới; ra khỏi mép lưới thì rời
+# mạng. Xe chuyển nút có hiệu lực từ bước sau, dù hai nút cùng hay khác tiến trình.
+# Mỗi tiến trình giữ một dải hàng liền nhau nên chỉ xe đi xuống từ hàng cuối của
+# dải mới phải gửi sang tiến trình khác.
+ENTRY_LINE = -100  # Vị trí đầu đoạn đường khi xe vào nút kế tiếp
+
+def downstream_node(cols, rows, node, lane):
+    # Nút nhận xe ra khỏi làn `lane` của nút `node`, None nếu xe rời lưới
+    row, col = divmod(node, cols)
+    if lane < 2:
+        col += 1
+    else:
+        row += 1
+    if row >= rows or col >= cols:
+        return None
+    return row * cols + col
+
+class GridShard:
+    # Một dải hàng [first_row, last_row) của lưới, chạy trong một tiến trình
+    def __init__(self, rows, cols, first_row, last_row, seed=None):
+        self.rows, self.cols = rows, cols
+        self.nodes = range(first_row * cols, last_row * cols)
+        self.managers = []
+        for node in self.nodes:
+            # Mỗi nút một dãy ngẫu nhiên theo (seed, nút): kết quả không phụ thuộc số tiến trình
+            manager = TrafficManager(clock=VirtualClock(), write_data=False,
+                                     seed=None if seed is None else f"{seed}:{node}")
+            manager.cars.outflow = []
+            self.managers.append(manager)
+        # Thời điểm mỗi nút bắt đầu chu kỳ kế tiếp, None khi chu kỳ đang chạy
+        self.next_cycle_at = [0.0] * len(self.managers)
+        self.tick = 1 / CONFIG["TICK_RATE"]
+        self.ticks = 0
+        self.pending = []  # Xe chuyển giữa các nút trong dải, nhận ở bước sau
+        self.left = 0  # Số xe đã rời lưới
+    
+    def admit(self, transfers):
+        # transfers: [(nút, làn, loại, vị trí), ...]
+        by_node = {}
+        for node, lane, type_id, position in transfers:
+            by_node.setdefault(node, []).append((lane, type_id, position))
+        for node, rows in by_node.items():
+            lane, type_id, position = zip(*rows)
+            self.managers[node - self.nodes.start].cars.admit(
+                np.array(lane), np.array(type_id), np.array(position))
+    
+    def step(self, inbound):
+        # Chạy mọi nút giao thêm một bước, trả về xe phải gửi sang dải khác
+        self.admit(self.pending + inbound)
+        self.pending = []
+        outbound = []
+        self.ticks += 1
+        until = self.ticks * self.tick
+        
+        for offset, manager in enumerate(self.managers):
+            # Các nút tự chạy chu kỳ nối tiếp nhau, nghỉ CYCLE_GAP giây giữa hai chu kỳ
+            if not manager.cycle_running:
+                now = manager.clock.now()
+                if self.next_cycle_at[offset] is None:
+                    self.next_cycle_at[offset] = now + CONFIG["CYCLE_GAP"]
+                if now >= self.next_cycle_at[offset]:
+                    self.next_cycle_at[offset] = None
+                    manager.start_cycle(manager.current_cycle + 1)
+            manager.run_until(until)
+            
+            outflow = manager.cars.outflow
+            if not outflow:
+                continue
+            node = self.nodes.start + offset
+            for lanes, type_ids, overshoot in outflow:
+                for lane, type_id, extra in zip(lanes.tolist(), type_ids.tolist(), overshoot.tolist()):
+                    target = downstream_node(self.cols, self.rows, node, lane)
+                    if target is None:
+                        self.left += 1
+                    elif target in self.nodes:
+                        self.pending.append((target, lane, type_id, ENTRY_LINE + extra))
+                    else:
+                        outbound.append((target, lane, type_id, ENTRY_LINE + extra))
+            outflow.clear()
+        return outbound
+    
+    def stats(self):
+        return {
+            "intersections": len(self.managers),
+            "vehicles": sum(len(manager.cars) for manager in self.managers),
+            "queued": sum(len(queue) for manager in self.managers for queue in manager.cars.entry_queues),
+            "passed": sum(manager.light.total_vehicles_passed for manager in self.managers),
+            "left": self.left,
+            "cycles": sum(manager.current_cycle for manager in self.managers)
+        }
+
+def shard_worker(connection, config, seed, rows, cols, first_row, last_row):
+    # Tiến trình con: nhận lệnh qua Pipe cho tới khi được yêu cầu dừng
+    CONFIG.update(config)
+    logger.set_levels(**CONFIG["LOG_LEVELS"])
+    # Luồng ghi log của tiến trình cha không đi theo sang tiến trình con
+    logger.writer = BufferedLogWriter(CONFIG["LOG_FILE"])
+    shard = GridShard(rows, cols, first_row, last_row, seed)
+    try:
+        while True:
+            command, payload = connection.recv()
+            if command == "step":
+                connection.send(shard.step(payload))
+            elif command == "stats":
+                connection.send(shard.stats())
+            elif command == "close":
+                break
+    finally:
+        logger.close()
+        connection.close()
+
+class GridNetwork:
+    # Chia lưới theo dải hàng cho các tiến trình; mỗi bước gửi xe qua biên dải
+    # tới đúng tiến trình rồi cho tất cả chạy bước kế tiếp song song
+    def __init__(self, rows, cols, workers=None, seed=None):
+        import multiprocessing
+        
+        self.rows, self.cols = rows, cols
+        workers = max(1, min(workers or os.cpu_count() or 1, rows))
+        self.bounds = [rows * k // workers for k in range(workers + 1)]
+        self.connections = []
+        self.processes = []
+        for k in range(workers):
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=shard_worker, name=f"grid-shard-{k}", daemon=True,
+                args=(child_end, CONFIG, seed, rows, cols, self.bounds[k], self.bounds[k + 1])
+            )
+            process.start()
+            child_end.close()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        self.inbound = [[] for _ in range(workers)]
+        self.ticks = 0
+    
+    def shard_of(self, node):
+        row = node // self.cols
+        for k in range(len(self.connections)):
+            if row < self.bounds[k + 1]:
+                return k
+        raise ValueError(f"nút {node} nằm ngoài lưới")
+    
+    def step(self):
+        for connection, inbound in zip(self.connections, self.inbound):
+            connection.send(("step", inbound))
+        self.inbound = [[] for _ in self.connections]
+        for connection in self.connections:
+            for transfer in connection.recv():
+                self.inbound[self.shard_of(transfer[0])].append(transfer)
+        self.ticks += 1
+    
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+    
+    def stats(self):
+        for connection in self.connections:
+            connection.send(("stats", None))
+        totals = {}
+        for connection in self.connections:
+            for key, value in connection.recv().items():
+                totals[key] = totals.get(key, 0) + value
+        totals["in_transit"] = sum(len(inbound) for inbound in self.inbound)
+        return totals
+    
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+def run_network(rows, cols, seconds, workers=None, seed=None):
+    # Chạy lưới trong `seconds` giây mô phỏng và báo tốc độ tổng
+    network = GridNetwork(rows, cols, workers, seed)
+    try:
+        ticks = int(round(seconds * CONFIG["TICK_RATE"]))
+        started = time.perf_counter()
+        network.run(ticks)
+        elapsed = time.perf_counter() - started
+        stats = network.stats()
+    finally:
+        network.close()
+    
+    stats.update(workers=len(network.processes), ticks=ticks, elapsed=elapsed,
+                 ticks_per_sec=ticks / elapsed,
+                 intersection_ticks_per_sec=ticks * rows * cols / elapsed)
+    print(f"🏙️ {rows}x{cols} = {rows * cols} nút giao, {stats['workers']} tiến trình: "
+          f"{ticks} bước trong {elapsed:.2f}s ({stats['ticks_per_sec']:.1f} bước/s, "
+          f"{stats['intersection_ticks_per_sec']:.0f} nút-bước/s), "
+          f"{stats['passed']} xe đã qua, {stats['left']} xe rời lưới, {stats['vehicles']} xe trên đường, "
+          f"{stats['queued']} xe chờ vào làn")
+    return stats
+
+# ==============================
+# 🏋️ MÔI TRƯỜNG HUẤN LUYỆN (KIỂU GYM)
+# ==============================
+# Điều khiển TrafficManager từng bước bằng đồng hồ ảo để huấn luyện bộ điều khiển:
+# mỗi bước chọn một pha trong CONFIG["SIGNAL_PHASES"] được xanh trong step_seconds
+# giây (đổi pha thì pha cũ vàng YELLOW_MIN giây trước). Quan sát là mảng NumPy:
+# số xe, hàng chờ, số xe ưu tiên chưa qua của từng làn và pha hiện tại (one-hot).
+class TrafficEnv:
+    QUEUE_WEIGHT = 0.1  # Phần thưởng = số xe qua trong bước - QUEUE_WEIGHT * tổng hàng chờ
+    
+    def __init__(self, step_seconds=5, max_steps=720, seed=None):
+        self.step_seconds = step_seconds
+        self.max_steps = max_steps
+        self.seed = seed
+        self.seeds = random.Random(seed)  # Mỗi tập một hạt giống rút từ dãy này
+        self.phases = LightController.stages()
+        self.action_count = len(self.phases)
+        self.observation_size = VehicleStore.LANES * 3 + self.action_count
+        self.manager = None
+        self.phase = None
+        self.steps = 0
+    
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed = seed
+            self.seeds = random.Random(seed)
+        self.manager = TrafficManager(clock=VirtualClock(), write_data=False, seed=self.seeds.getrandbits(64))
+        self.manager.light.quiet = True
+        self.phase = None
+        self.steps = 0
+        observation, _ = self.observe()
+        return observation
+    
+    def observe(self):
+        # Đọc thẳng bộ đếm của VehicleStore: không qua cảm biến nên không ghi log
+        # hay thêm vào lịch sử quét của nút giao ở mỗi bước
+        cars = self.manager.cars
+        lanes = VehicleStore.LANES
+        queue_lengths = [cars.queue_length(lane) for lane in range(lanes)]
+        observation = np.zeros(self.observation_size)
+        observation[:lanes] = cars.lane_counts
+        observation[lanes:2 * lanes] = queue_lengths
+        observation[2 * lanes:3 * lanes] = cars.unpassed_counts[:, cars.TYPE_PRIORITIES > 0].sum(axis=1)
+        if self.phase is not None:
+            observation[3 * lanes + self.phase] = 1.0
+        return observation, queue_lengths
+    
+    def step(self, action):
+        if not 0 <= action < self.action_count:
+            raise ValueError(f"Hành động {action} ngoài khoảng 0..{self.action_count - 1}")
+        manager = self.manager
+        at = manager.clock.now()
+        if self.phase is not None and self.phase != action:
+            yellow = CONFIG["YELLOW_MIN"]
+            manager.scheduler.push(at, "phase", (lane_states_for(self.phases[self.phase], "yellow"), yellow))
+            at += yellow
+        manager.scheduler.push(at, "phase", (lane_states_for(self.phases[action], "green"), self.step_seconds))
+        end = at + self.step_seconds
+        
+        # Xe ưu tiên được đi như trong chu kỳ thường, với loại xe ưu tiên đang chờ thật
+        waiting, type_id, _ = manager.cars.waiting_priority()
+        if waiting and not manager.light.priority_active:
+            manager.light.activate_priority(Car.TYPE_NAMES[type_id], end - manager.clock.now())
+            manager.scheduler.push(manager.light.priority_end_time, "priority_end")
+        
+        passed_before = manager.light.total_vehicles_passed
+        manager.run_until(end)
+        self.phase = action
+        self.steps += 1
+        
+        observation, queue_lengths = self.observe()
+        passed = manager.light.total_vehicles_passed - passed_before
+        reward = passed - self.QUEUE_WEIGHT * sum(queue_lengths)
+        done = self.steps >= self.max_steps
+        info = {"time": end, "passed": passed, "queue_lengths": queue_lengths}
+        return observation, reward, done, info
+
+class VectorTrafficEnv:
+    # N nút giao độc lập bước cùng lúc; nút nào hết tập thì tự bắt đầu lại.
+    # Môi trường thứ i dùng hạt giống seed + first + i
+    def __init__(self, count, step_seconds=5, max_steps=720, seed=None, first=0):
+        self.first = first
+        self.envs = [TrafficEnv(step_seconds, max_steps, None if seed is None else seed + first + i)
+                     for i in range(count)]
+        self.action_count = self.envs[0].action_count
+        self.observation_size = self.envs[0].observation_size
+    
+    def __len__(self):
+        return len(self.envs)
+    
+    def reset(self, seed=None):
+        return np.stack([env.reset(None if seed is None else seed + self.first + i)
+                         for i, env in enumerate(self.envs)])
+    
+    def step(self, actions):
+        observations = np.empty((len(self.envs), self.observation_size))
+        rewards = np.empty(len(self.envs))
+        dones = np.zeros(len(self.envs), dtype=bool)
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, np.asarray(actions).tolist())):
+            observations[i], rewards[i], dones[i], info = env.step(action)
+            if dones[i]:
+                info["final_observation"] = observations[i].copy()
+                observations[i] = env.reset()
+            infos.append(info)
+        return observations, rewards, dones, infos
+
+def env_worker(connection, config, seed, first, count, step_seconds, max_steps):
+    # Tiến trình con giữ một nhóm môi trường, nhận lệnh qua Pipe như shard_worker
+    CONFIG.update(config)
+    logger.set_levels(**CONFIG["LOG_LEVELS"])
+    logger.writer = BufferedLogWriter(CONFIG["LOG_FILE"])
+    envs = VectorTrafficEnv(count, step_seconds, max_steps, seed, first)
+    try:
+        while True:
+            command, payload = connection.recv()
+            if command == "step":
+                connection.send(envs.step(payload))
+            elif command == "reset":
+                connection.send(envs.reset(payload))
+            elif command == "close":
+                break
+    finally:
+        logger.close()
+        connection.close()
+
+class ParallelTrafficEnv:
+    # Như VectorTrafficEnv nhưng chia các môi trường cho nhiều tiến trình: mỗi
+    # bước gửi hành động cho mọi tiến trình rồi gộp kết quả theo thứ tự
+    def __init__(self, count, step_seconds=5, max_steps=720, seed=None, workers=None):
+        import multiprocessing
+        
+        workers = max(1, min(workers or os.cpu_count() or 1, count))
+        self.bounds = [count * k // workers for k in range(workers + 1)]
+        self.connections = []
+        self.processes = []
+        for k in range(workers):
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=env_worker, name=f"traffic-env-{k}", daemon=True,
+                args=(child_end, CONFIG, seed, self.bounds[k], self.bounds[k + 1] - self.bounds[k],
+                      step_seconds, max_steps)
+            )
+            process.start()
+            child_end.close()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        probe = TrafficEnv(step_seconds, max_steps)
+        self.action_count = probe.action_count
+        self.observation_size = probe.observation_size
+    
+    def __len__(self):
+        return self.bounds[-1]
+    
+    def reset(self, seed=None):
+        for connection in self.connections:
+            connection.send(("reset", seed))
+        return np.concatenate([connection.recv() for connection in self.connections])
+    
+    def step(self, actions):
+        actions = np.asarray(actions)
+        for k, connection in enumerate(self.connections):
+            connection.send(("step", actions[self.bounds[k]:self.bounds[k + 1]]))
+        results = [connection.recv() for connection in self.connections]
+        infos = [info for result in results for info in result[3]]
+        return (np.concatenate([result[0] for result in results]),
+                np.concatenate([result[1] for result in results]),
+                np.concatenate([result[2] for result in results]), infos)
+    
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+def run_env_benchmark(count, steps, workers=1, seed=None):
+    # Đo số bước môi trường/giây với hành động ngẫu nhiên
+    if workers > 1:
+        env = ParallelTrafficEnv(count, seed=seed, workers=workers)
+    else:
+        env = VectorTrafficEnv(count, seed=seed)
+    try:
+        env.reset()
+        actions = np.random.default_rng(seed).integers(env.action_count, size=(steps, count))
+        started = time.perf_counter()
+        for step_actions in actions:
+            env.step(step_actions)
+        elapsed = time.perf_counter() - started
+    finally:
+        if workers > 1:
+            env.close()
+    print(f"🏋️ {count} môi trường x {steps} bước, {workers} tiến trình: {elapsed:.2f}s, "
+          f"{count * steps / elapsed:.0f} bước môi trường/s")
+
+# ==============================
+# 💾 BỘ NHỚ ĐỆM KẾT QUẢ
+# ==============================
+# Kết quả một lần chạy headless chỉ phụ thuộc CONFIG, bộ điều khiển, hạt giống và
+# mã nguồn, nên được lưu theo mã băm của bốn thứ đó: <mã>.json (chỉ số tóm tắt) và
+# <mã>.npz (loại, thời gian chờ từng xe). Lần dùng gần nhất ghi vào mtime; vượt
+# CACHE_MAX_BYTES thì xóa các kết quả lâu không dùng nhất.
+# Các mục CONFIG không ảnh hưởng kết quả chạy headless
+CACHE_KEY_IGNORED = {
+    "LOG_FILE", "LOG_FLUSH_INTERVAL", "LOG_BATCH_SIZE", "LOG_BUFFER_SIZE", "LOG_LEVELS",
+    "HTTP_PORT", "HTTP_MAX_WORKERS", "HTTP_QUEUE_TIMEOUT", "HTTP_TIMEOUT", "HTTP_KEEPALIVE_TIMEOUT",
+    "STATE_FILE", "KEYFRAME_INTERVAL", "CACHE_DIR", "CACHE_MAX_BYTES", "WARMUP_MINUTES",
+    "PROFILING"
+}
+_code_versions = {}
+
+def code_version(path=None):
+    # Mã băm nội dung file nguồn: sửa mô phỏng thì kết quả cũ tự hết hiệu lực
+    path = path or os.path.abspath(__file__)
+    if path not in _code_versions:
+        with open(path, "rb") as f:
+            _code_versions[path] = hashlib.sha256(f.read()).hexdigest()
+    return _code_versions[path]
+
+def controller_identity(name=None):
+    # Tên bộ điều khiển, kèm mã băm file nguồn nếu là bộ ngoài "module:Lớp"
+    name = name or CONFIG["CONTROLLER"]
+    if ":" in name:
+        import importlib.util
+        spec = importlib.util.find_spec(name.partition(":")[0])
+        if spec is not None and spec.origin and os.path.isfile(spec.origin):
+            return f"{name}@{code_version(spec.origin)}"
+    return name
+
+def result_key(seed, cycles=None, params=None):
+    config = {key: value for key, value in CONFIG.items() if key not in CACHE_KEY_IGNORED}
+    config.update(params or {})
+    config["MAX_CYCLES"] = cycles or config["MAX_CYCLES"]
+    content = json.dumps({
+        "config": config,
+        "controller": controller_identity(config["CONTROLLER"]),
+        "seed": seed,
+        "code": code_version()
+    }, sort_keys=True, default=list)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = os.path.abspath(directory or CONFIG["CACHE_DIR"])
+        self.max_bytes = max_bytes or CONFIG["CACHE_MAX_BYTES"]
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0  # Thời gian tính toán của các lần chạy được lấy lại từ cache
+        self.evicted = 0
+    
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+    
+    def get(self, key):
+        try:
+            with open(self.path(key, ".json"), "rb") as f:
+                result = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(self.path(key, ".json"))
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        self.saved_seconds += result.get("elapsed", 0.0)
+        return result
+    
+    def put(self, key, result):
+        write_file_atomic(self.path(key, ".json"), json.dumps(result).encode("utf-8"))
+        self.evict()
+    
+    def entries(self):
+        # {mã: [lần dùng gần nhất, số byte]}
+        entries = {}
+        for entry in os.scandir(self.directory):
+            key, dot, suffix = entry.name.partition(".")
+            if not dot or suffix != "json":
+                continue
+            stat = entry.stat()
+            entries[key] = [stat.st_mtime, stat.st_size]
+        return entries
+    
+    def size(self):
+        return sum(size for _, size in self.entries().values())
+    
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(key, ".json"))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evicted += 1
+    
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return (f"💾 Cache: {self.hits} trúng, {self.misses} trượt ({rate:.0f}% trúng), "
+                f"tiết kiệm ~{self.saved_seconds:.1f}s tính toán, "
+                f"{self.size() / 1024 / 1024:.1f} MB trên đĩa, {self.evicted} kết quả bị xóa")
+
+# ==============================
+# 🎲 CHẠY LẶP MONTE CARLO
+# ==============================
+# Mỗi lần chạy headless là một mẫu ngẫu nhiên (xe tới, loại xe, thời gian vàng).
+# Chạy N lần với hạt giống seed, seed + 1, ... trên nhiều tiến trình rồi gộp lại
+# thành trung bình kèm khoảng tin cậy 95%. Thời gian chờ tính mọi xe đã tới, xe chưa
+# rời đường khi hết giờ thì tính tới lúc kết thúc (số xe này được in kèm báo cáo).
+REPLICATION_METRICS = {
+    "passed": "Xe đã qua",
+    "mean_wait": "Chờ trung bình (s)",
+    "p50_wait": "Chờ trung vị (s)",
+    "p95_wait": "Chờ p95 (s)",
+    "emergency_delay": "Trễ xe ưu tiên (s)"
+}
+# Phân vị 0.975 của phân phối Student với 1..30 bậc tự do; nhiều hơn dùng 1.96
+T_975 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+def confidence_interval(values):
+    # (trung bình, nửa độ rộng khoảng tin cậy 95%) của các giá trị khác None
+    values = np.array([value for value in values if value is not None], dtype=np.float64)
+    if len(values) == 0:
+        return None, None
+    if len(values) == 1:
+        return float(values[0]), 0.0
+    t = T_975[len(values) - 2] if len(values) <= len(T_975) + 1 else 1.96
+    return float(values.mean()), float(t * values.std(ddof=1) / np.sqrt(len(values)))
+
+def run_replication(seed, cycles=None):
+    # Một lần chạy headless với hạt giống riêng, trả về các chỉ số tóm tắt. Thời gian
+    # chờ gồm cả xe chưa rời đường khi hết giờ (còn trên đường hoặc trong hàng đợi ảo),
+    # tính tới lúc kết thúc: bỏ chúng đi sẽ làm lần chạy quá tải trông như ít phải chờ
+
+    started = time.perf_counter()
+    traffic_manager = TrafficManager(clock=VirtualClock(), write_data=False, seed=seed)
+    traffic_manager.cars.finished = []
+    run_simulation(traffic_manager, CONFIG["MAX_CYCLES"] if cycles is None else cycles)
+    
+    cars = traffic_manager.cars
+    queued = [entry for queue in cars.entry_queues for entry in queue]
+    finished = cars.finished + [
+        (cars.type_id[:cars.size], cars.waiting_time[:cars.size]),
+        (np.array([entry[0] for entry in queued], dtype=np.int8),
+         np.array([cars.tick_count - entry[2] for entry in queued], dtype=np.int64))
+    ]
+    types = np.concatenate([types for types, _ in finished])
+    waits = np.concatenate([waits for _, waits in finished]) / CONFIG["TICK_RATE"]
+    emergency = waits[VehicleStore.TYPE_PRIORITIES[types] > 0]
+    result = {
+        "seed": seed,
+        "passed": traffic_manager.light.total_vehicles_passed,
+        "vehicles": len(waits),
+        "censored": cars.size + len(queued),  # Xe chưa rời đường, thời gian chờ tính tới lúc kết thúc
+        "mean_wait": float(waits.mean()) if len(waits) else 0.0,
+        "p50_wait": float(np.percentile(waits, 50)) if len(waits) else 0.0,
+        "p95_wait": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+        "emergency_vehicles": len(emergency),
+        # Lần chạy không có xe ưu tiên nào thì không tính vào trung bình
+        "emergency_delay": float(emergency.mean()) if len(emergency) else None,
+        "simulated": traffic_manager.clock.now(),
+        "elapsed": time.perf_counter() - started
+    }
+    return result
+
+def replication_init(config):
+    # Khởi tạo mỗi tiến trình của pool: dùng CONFIG và mức log của tiến trình cha
+    CONFIG.update(config)
+    logger.set_levels(**CONFIG["LOG_LEVELS"])
+    logger.writer = BufferedLogWriter(CONFIG["LOG_FILE"])
+
+def run_candidate(params, seed, cycles=None):
+    # Một lần chạy với bộ tham số `params` đè lên CONFIG của tiến trình
+    saved = {key: CONFIG[key] for key in params}
+    CONFIG.update(params)
+    try:
+        return run_replication(seed, cycles)
+    finally:
+        CONFIG.update(saved)
+
+def run_jobs(pool, jobs, cycles=None, cache=None, chunksize=1):
+    # Chạy các (bộ tham số, hạt giống) trên pool, bỏ qua lần chạy đã có trong cache
+    keys = [result_key(seed, cycles, params) for params, seed in jobs] if cache else None
+    results = [cache.get(key) for key in keys] if cache else [None] * len(jobs)
+    missing = [i for i, result in enumerate(results) if result is None]
+    computed = pool.map(run_candidate, [jobs[i][0] for i in missing], [jobs[i][1] for i in missing],
+                        [cycles] * len(missing), chunksize=chunksize)
+    for i, result in zip(missing, computed):
+        if cache:
+            cache.put(keys[i], result)
+        results[i] = result
+    return results
+
+def run_replications(runs, seed=0, cycles=None, workers=None, cache=None):
+    # Chạy `runs` lần song song, trả về (kết quả từng lần, {chỉ số: (trung bình, ±)})
+    from concurrent.futures import ProcessPoolExecutor
+    
+    workers = max(1, min(workers or os.cpu_count() or 1, runs))
+    jobs = [({}, seed + i) for i in range(runs)]
+    with ProcessPoolExecutor(workers, initializer=replication_init, initargs=(CONFIG,)) as pool:
+        results = run_jobs(pool, jobs, cycles, cache, chunksize=max(1, runs // (workers * 4)))
+    summary = {metric: confidence_interval([result[metric] for result in results])
+               for metric in REPLICATION_METRICS}
+    return results, summary
+
+def print_replication_report(results, summary, elapsed, workers):
+    print(f"🎲 {len(results)} lần chạy, {workers} tiến trình trong {elapsed:.2f}s "
+          f"({len(results) / elapsed:.2f} lần/s), {sum(r['vehicles'] for r in results)} xe, trong đó "
+          f"{sum(r['censored'] for r in results)} xe chưa rời đường (chờ tính tới lúc kết thúc)")
+    for metric, label in REPLICATION_METRICS.items():
+        mean, half_width = summary[metric]
+        if mean is None:
+            print(f"   {label:<22} không có dữ liệu")
+        else:
+            print(f"   {label:<22} {mean:10.2f} ± {half_width:.2f}")
+
+# ==============================
+# 🔧 DÒ THAM SỐ SONG SONG
+# ==============================
+# Thử các bộ giá trị của TUNING_SPACE, mỗi bộ chạy headless trên cùng một dãy hạt
+# giống (số ngẫu nhiên chung: khác biệt giữa hai bộ đến từ tham số chứ không phải
+# từ lượt rút xe), rồi giữ các bộ không bị bộ nào khác trội hơn về cả thông lượng
+# (xe qua mỗi giờ mô phỏng) lẫn thời gian chờ trung bình (biên Pareto).
+TUNING_SPACE = {
+    "LIGHT_MIN": [3, 5, 8],
+    "LIGHT_MAX": [10, 15, 20, 30],
+    "YELLOW_MIN": [2, 3, 4],
+    "YELLOW_MAX": [3, 5, 7],
+    "DENSITY_THRESHOLDS": [(3, 6, 10), (5, 10, 15), (8, 15, 25)]
+}
+
+def tuning_candidates():
+    # Mọi bộ giá trị hợp lệ của TUNING_SPACE (MIN không lớn hơn MAX)
+    keys = list(TUNING_SPACE)
+    candidates = []
+    for values in itertools.product(*TUNING_SPACE.values()):
+        params = dict(zip(keys, values))
+        if params["LIGHT_MIN"] <= params["LIGHT_MAX"] and params["YELLOW_MIN"] <= params["YELLOW_MAX"]:
+            candidates.append(params)
+    return candidates
+
+def candidate_vector(params):
+    # Tọa độ [0, 1] của bộ giá trị theo vị trí trong từng danh sách, cho mô hình thay thế
+    return np.array([TUNING_SPACE[key].index(value) / max(1, len(TUNING_SPACE[key]) - 1)
+                     for key, value in params.items()])
+
+def evaluate_candidates(pool, candidates, seeds, cycles=None, cache=None):
+    # Chạy mọi (bộ tham số, hạt giống) song song, gộp trung bình theo từng bộ. Cùng
+    # số chu kỳ nhưng độ dài chu kỳ phụ thuộc tham số, nên thông lượng tính theo xe
+    # mỗi giờ mô phỏng chứ không theo tổng số xe qua
+    jobs = [(params, seed) for params in candidates for seed in seeds]
+    results = run_jobs(pool, jobs, cycles, cache)
+    evaluated = []
+    for i, params in enumerate(candidates):
+        runs = results[i * len(seeds):(i + 1) * len(seeds)]
+        evaluated.append({
+            "params": params,
+            "throughput": float(np.mean([run["passed"] * 3600 / run["simulated"] for run in runs])),
+            "passed": float(np.mean([run["passed"] for run in runs])),
+            "mean_wait": float(np.mean([run["mean_wait"] for run in runs]))
+        })
+    return evaluated
+
+def pareto_front(evaluated):
+    # Các điểm không bị trội: không có điểm nào thông lượng (xe/giờ) cao hơn mà chờ
+    # không lâu hơn (hoặc ngược lại)
+    front = []
+    for point in evaluated:
+        dominated = any(
+            other["throughput"] >= point["throughput"] and other["mean_wait"] <= point["mean_wait"]
+            and (other["throughput"] > point["throughput"] or other["mean_wait"] < point["mean_wait"])
+            for other in evaluated
+        )
+        if not dominated:
+            front.append(point)
+    return sorted(front, key=lambda point: -point["throughput"])
+
+def propose_candidates(evaluated, remaining, count, rng):
+    # Tìm kiếm kiểu Bayes: hồi quy quá trình Gauss (nhân RBF) trên điểm đã chạy
+    # với trọng số ngẫu nhiên giữa hai mục tiêu, chọn điểm có cận trên tin cậy lớn nhất
+    x = np.array([candidate_vector(point["params"]) for point in evaluated])
+    throughput = np.array([point["throughput"] for point in evaluated])
+    waits = np.array([point["mean_wait"] for point in evaluated])
+    scale = lambda values: (values - values.min()) / (np.ptp(values) or 1.0)
+    grid = np.array([candidate_vector(params) for params in remaining])
+    
+    def kernel(a, b, length=0.3):
+        return np.exp(-((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2) / (2 * length ** 2))
+    
+    k_inverse = np.linalg.inv(kernel(x, x) + 1e-3 * np.eye(len(x)))
+    cross = kernel(grid, x)
+    variance = np.clip(1.0 - np.einsum("ij,jk,ik->i", cross, k_inverse, cross), 0.0, None)
+    chosen = []
+    for _ in range(min(count, len(remaining))):
+        weight = rng.random()
+        score = weight * scale(throughput) - (1 - weight) * scale(waits)
+        score = (score - score.mean()) / (score.std() or 1.0)
+        upper = cross @ k_inverse @ score + 2.0 * np.sqrt(variance)
+        upper[chosen] = -np.inf
+        chosen.append(int(np.argmax(upper)))
+    return [remaining[i] for i in chosen]
+
+def run_tuning(search="random", trials=32, runs=5, seed=0, cycles=None, workers=None, cache=None):
+    # search: "grid" thử mọi bộ; "random" lấy ngẫu nhiên `trials` bộ; "bayes" bắt đầu
+    # bằng một lô ngẫu nhiên rồi đề xuất từng lô theo mô hình thay thế
+    from concurrent.futures import ProcessPoolExecutor
+    
+    workers = max(1, workers or os.cpu_count() or 1)
+    seeds = [seed + i for i in range(runs)]
+    rng = np.random.default_rng(seed)
+    candidates = tuning_candidates()
+    if search != "grid":
+        candidates = [candidates[i] for i in rng.permutation(len(candidates))]
+    with ProcessPoolExecutor(workers, initializer=replication_init, initargs=(CONFIG,)) as pool:
+        if search == "grid":
+            evaluated = evaluate_candidates(pool, candidates, seeds, cycles, cache)
+        elif search == "random":
+            evaluated = evaluate_candidates(pool, candidates[:trials], seeds, cycles, cache)
+        else:
+            initial = max(2, trials // 4)
+            evaluated = evaluate_candidates(pool, candidates[:initial], seeds, cycles, cache)
+            remaining = candidates[initial:]
+            while len(evaluated) < trials and remaining:
+                batch = propose_candidates(evaluated, remaining, min(workers, trials - len(evaluated)), rng)
+                remaining = [params for params in remaining if params not in batch]
+                evaluated += evaluate_candidates(pool, batch, seeds, cycles, cache)
+    return evaluated, pareto_front(evaluated)
+
+def print_tuning_report(evaluated, front, elapsed):
+    print(f"🔧 {len(evaluated)} bộ tham số trong {elapsed:.2f}s; biên Pareto (xe/giờ / chờ trung bình):")
+    for point in front:
+        params = ", ".join(f"{key}={value}" for key, value in point["params"].items())
+        print(f"   {point['throughput']:8.1f} xe/giờ  {point['mean_wait']:7.2f}s  {params}")
 
 # ==============================
 # 🌐 GIAO DIỆN WEB NÂNG CAO
@@ -1634,6 +2985,19 @@ border-radius: 10px;
             });
         }
         
+        // Đèn riêng của từng làn, ngay trước vạch dừng
+        function drawLaneSignals(laneStates) {
+            if (!laneStates) return;
+            const colors = { red: '#e74c3c', yellow: '#f39c12', green: '#27ae60' };
+            const laneHeight = canvasHeight / 4;
+            laneStates.forEach((state, lane) => {
+                ctx.beginPath();
+                ctx.arc(335, 40 + lane * laneHeight, 8, 0, Math.PI * 2);
+                ctx.fillStyle = colors[state] || '#7f8c8d';
+                ctx.fill();
+            });
+        }
+        
         // Vẽ xe
         function drawCars(cars) {
             cars.forEach(car => {
@@ -1694,21 +3058,69 @@ ctx.fillStyle = 'red';
             // Vẽ các thành phần
             drawRoad();
             drawTrafficLight(data.light_state);
+            drawLaneSignals(data.lane_states);
             drawCars(data.cars);
         }
         
-        // Lấy dữ liệu từ server
+        // Hiển thị một trạng thái mới
+        function render(data) {
+            simulationData = data;
+            updateDisplay(simulationData);
+            drawScene(simulationData);
+        }
+        
+        // Lấy dữ liệu từ server (lần đầu hoặc khi trình duyệt không hỗ trợ SSE)
         async function fetchData() {
             try {
-                const response = await fetch('traffic_data.json?t=' + new Date().getTime());
-                simulationData = await response.json();
-                updateDisplay(simulationData);
-                drawScene(simulationData);
+                const response = await fetch('/api/state');
+                render(await response.json());
             } catch (error) {
                 console.error('Lỗi khi tải dữ liệu:', error);
             }
         }
         
+        // Trạng thái dựng lại từ các khung server đẩy về
+        const stream = { types: {}, vehicles: new Map(), log: [] };
+        
+        // Áp một khung: "key" thay toàn bộ, "delta" chỉ sửa phần thay đổi
+        function applyFrame(frame) {
+            if (frame.type === 'key') {
+                stream.types = frame.types;
+                stream.vehicles = new Map(frame.cars.map(row => [row[0], row.slice(1)]));
+                stream.log = [];
+            } else {
+                frame.created.forEach(row => stream.vehicles.set(row[0], row.slice(1)));
+                frame.moved.forEach(([id, position, waiting]) => {
+                    const vehicle = stream.vehicles.get(id);
+                    if (vehicle) {
+                        vehicle[2] = position;
+                        vehicle[3] = waiting;
+                    }
+                });
+                frame.removed.forEach(id => stream.vehicles.delete(id));
+            }
+            stream.log = stream.log.concat(frame.log).slice(-10);
+            
+            const data = Object.assign({}, frame);
+            data.cars = Array.from(stream.vehicles, ([id, [lane, typeId, position, waiting]]) => ({
+                id: id,
+                lane: lane,
+                type: stream.types[typeId][0],
+                emoji: stream.types[typeId][1],
+                position: position,
+                waiting_time: waiting
+            }));
+            data.log = stream.log;
+            return data;
+        }
+        
+        // Nhận các khung do server đẩy về mỗi bước mô phỏng (Server-Sent Events)
+        function subscribe() {
+            const source = new EventSource('/api/stream');
+            source.onmessage = (event) => render(applyFrame(JSON.parse(event.data)));
+            source.onerror = () => console.warn('Mất kết nối luồng dữ liệu, đang kết nối lại...');
+        }
+        
         // Xóa log
         function clearLog() {
             const logElement = document.getElementById('log');
@@ -1716,8 +3128,12 @@ ctx.fillStyle = 'red';
         }
         
         // Bắt đầu cập nhật
-        setInterval(fetchData, 500);
         fetchData();
+        if (window.EventSource) {
+            subscribe();
+        } else {
+            setInterval(fetchData, 500);
+        }
     </script>
 </body>
 </html>"""
@@ -1725,24 +3141,82 @@ ctx.fillStyle = 'red';
 # ==============================
 # 🕹️ WEB SERVER
 # ==============================
-class TrafficHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def log_message(self, format, *args):
-        # Tắt log mặc định của HTTP server
-        pass
+def create_web_server(address, controls=None, metrics=None):
+    # Nạp http.server khi thật sự cần: lệnh simulate không phải trả chi phí này
+    from web_server import TrafficHTTPServer, TrafficHTTPRequestHandler
+    return TrafficHTTPServer(
+        address, TrafficHTTPRequestHandler, state_snapshot,
+        max_workers=CONFIG["HTTP_MAX_WORKERS"],
+        queue_timeout=CONFIG["HTTP_QUEUE_TIMEOUT"],
+        request_timeout=CONFIG["HTTP_TIMEOUT"],
+        keepalive_timeout=CONFIG["HTTP_KEEPALIVE_TIMEOUT"],
+        controls=controls,
+        metrics=metrics
+    )
+
+def run_http_benchmark(clients=32, duration=5.0):
+    # Dựng server trên cổng ngẫu nhiên với dữ liệu mô phỏng thật rồi đo /api/state
+    from web_server import benchmark_http
+    traffic_manager = TrafficManager(clock=VirtualClock())
+    traffic_manager.run_cycle(1)
+    httpd = create_web_server(("127.0.0.1", 0))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{httpd.server_address[1]}/api/state"
+        result = benchmark_http(url, clients, duration)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    print(f"📊 {result['clients']} kết nối: {result['requests_per_sec']:.0f} req/s, "
+          f"p50={result['p50_ms']:.2f}ms, p99={result['p99_ms']:.2f}ms, lỗi={result['errors']}")
+    return result
 
-def start_web_server():
+def metrics_text(traffic_manager):
+    # Nội dung /metrics theo định dạng văn bản của Prometheus: số liệu mô phỏng, kèm
+    # histogram thời gian từng giai đoạn khi bật --profile
+    cars = traffic_manager.cars
+    light = traffic_manager.light
+    lines = [
+        "# HELP traffic_vehicles_live Số xe đang có trên đường",
+        "# TYPE traffic_vehicles_live gauge",
+        f"traffic_vehicles_live {len(cars)}",
+        "# HELP traffic_vehicles_passed_total Số xe đã qua nút giao",
+        "# TYPE traffic_vehicles_passed_total counter",
+        f"traffic_vehicles_passed_total {light.total_vehicles_passed}",
+        "# HELP traffic_queue_length Số xe đứng chờ theo làn, kể cả xe chưa vào được làn",
+        "# TYPE traffic_queue_length gauge",
+        *(f'traffic_queue_length{{lane="{lane}"}} {cars.queue_length(lane)}' for lane in range(cars.LANES)),
+        "# HELP traffic_priority_activations_total Số lần kích hoạt ưu tiên",
+        "# TYPE traffic_priority_activations_total counter",
+        f"traffic_priority_activations_total {light.priority_activations}",
+        "# HELP traffic_cycle Chu kỳ đèn hiện tại",
+        "# TYPE traffic_cycle gauge",
+        f"traffic_cycle {traffic_manager.current_cycle}",
+        "# HELP traffic_tick_overruns_total Số bước trễ hạn quá một bước",
+        "# TYPE traffic_tick_overruns_total counter",
+        f"traffic_tick_overruns_total {traffic_manager.overruns}"
+    ]
+    if profiler.enabled:
+        lines += profiler.prometheus_lines()
+    return "\n".join(lines) + "\n"
+
+def start_web_server(open_browser=True, controls=None, metrics=None):
     # Tạo file HTML
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
     with open(HTML_FILE, "w", encoding="utf-8") as f:
         f.write(HTML_CONTENT)
     
     # Khởi động server
-    PORT = 8000
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    PORT = CONFIG["HTTP_PORT"]
     
-    with socketserver.TCPServer(("", PORT), TrafficHTTPRequestHandler) as httpd:
+    # Mỗi kết nối một luồng: luồng SSE giữ kết nối mở không chặn người xem khác
+    with create_web_server(("", PORT), controls, metrics) as httpd:
+        PORT = httpd.server_address[1]  # --port 0: hệ điều hành chọn cổng trống
         print(f"🌐 Server đang chạy tại: http://localhost:{PORT}")
         print("🔄 Đang khởi động mô phỏng giao thông...")
-        webbrowser.open(f"http://localhost:{PORT}/{HTML_FILE}")
+        if open_browser:
+            import webbrowser
+            webbrowser.open(f"http://localhost:{PORT}/{HTML_FILE}")
         
         try:
             httpd.serve_forever()
@@ -1752,42 +3226,362 @@ def start_web_server():
 # ==============================
 # 🚀 CHƯƠNG TRÌNH CHÍNH
 # ==============================
-def main():
+def run_simulation(traffic_manager, max_cycles, checkpoint=None, checkpoint_every=10):
+    # Chạy tiếp từ sau chu kỳ cuối đã bắt đầu, nên manager khôi phục từ điểm lưu
+    # cũng dùng được. checkpoint: file lưu trạng thái sau mỗi checkpoint_every chu kỳ
+    logger.log("🎬 Bắt đầu mô phỏng hệ thống đèn giao thông thông minh", "SYSTEM")
+    
+    try:
+        if traffic_manager.cycle_running:
+            # Điểm lưu giữa chu kỳ: chạy nốt chu kỳ đang dở
+            while traffic_manager.cycle_running:
+                traffic_manager.process_next_event()
+        if 0 < traffic_manager.current_cycle < max_cycles:
+            # Nghỉ nốt khoảng giữa chu kỳ đã xong và chu kỳ kế tiếp (điểm lưu cuối lần
+            # chạy được ghi ngay khi chu kỳ cuối kết thúc, trước khoảng nghỉ)
+            gap_end = traffic_manager.phase_end + CONFIG["CYCLE_GAP"]
+            if traffic_manager.clock.now() < gap_end:
+                traffic_manager.run_until(gap_end)
+        
+        for cycle in range(traffic_manager.current_cycle + 1, max_cycles + 1):
+            traffic_manager.run_cycle(cycle)
+            
+            # Nghỉ giữa các chu kỳ
+            if cycle < max_cycles:
+                traffic_manager.run_until(traffic_manager.clock.now() + CONFIG["CYCLE_GAP"])
+                if checkpoint and cycle % checkpoint_every == 0:
+                    traffic_manager.save_checkpoint(checkpoint)
+        if checkpoint:
+            traffic_manager.save_checkpoint(checkpoint)
+        
+        logger.log("✅ Mô phỏng hoàn tất! Tổng số xe đã qua: " + 
+                  str(traffic_manager.light.total_vehicles_passed), "SYSTEM")
+                  
+    except Exception as e:
+        # Ghi log rồi ném tiếp: lần chạy hỏng không được trả về như kết quả dang dở
+        # (replicate/tune sẽ đưa nó vào thống kê và cache)
+        logger.log(f"❌ Lỗi trong mô phỏng: {str(e)}", "ERROR")
+        raise
+
+def warm_up(minutes, seed=None):
+    # Chạy `minutes` phút mô phỏng đầu bằng đồng hồ ảo (không ngủ, không công bố trạng
+    # thái), dừng ở ranh giới chu kỳ rồi chuyển nguyên trạng thái sang đồng hồ thật qua
+    # điểm lưu trong bộ nhớ: dashboard mở ra đã có dòng xe ổn định thay vì làn trống
+    traffic_manager = TrafficManager(clock=VirtualClock(), write_data=False, seed=seed)
+    until = minutes * 60
+    started = time.perf_counter()
+    while traffic_manager.clock.now() < until:
+        traffic_manager.run_cycle(traffic_manager.current_cycle + 1)
+        traffic_manager.run_until(traffic_manager.clock.now() + CONFIG["CYCLE_GAP"])
+    logger.log(f"⏩ Chạy trước {minutes:g} phút mô phỏng ({traffic_manager.current_cycle} chu kỳ, "
+               f"{len(traffic_manager.cars)} xe) trong {time.perf_counter() - started:.2f}s", "SYSTEM")
+    return TrafficManager.from_checkpoint(traffic_manager.checkpoint_bytes(), WallClock())
+
+def run_headless(max_cycles=None, write_data=False, seed=None, record=None, trace=None,
+                 restore=None, checkpoint=None, checkpoint_every=10):
+    # Chạy mô phỏng bằng đồng hồ ảo: không web server, không ngủ; chỉ công bố
+    # trạng thái khi có nơi nhận (STATE_FILE). record: file ghi nhật ký để phát lại,
+    # trace: thư mục ghi vết từng bước, restore: điểm lưu để chạy tiếp
+    if restore:
+        traffic_manager = TrafficManager.from_checkpoint(restore, VirtualClock(), write_data)
+    else:
+        traffic_manager = TrafficManager(clock=VirtualClock(), write_data=write_data, seed=seed)
+    if trace:
+        traffic_manager.trace = TraceRecorder(trace)
+    if record:
+        traffic_manager.event_log = EventLog(seed)
+        traffic_manager.digest = hashlib.sha256()
+    run_simulation(traffic_manager, CONFIG["MAX_CYCLES"] if max_cycles is None else max_cycles,
+                   checkpoint, checkpoint_every)
+    if record:
+        # Phát lại chạy tới đúng chu kỳ cuối, kể cả khi max_cycles khác CONFIG
+        traffic_manager.event_log.config["MAX_CYCLES"] = traffic_manager.current_cycle
+        traffic_manager.event_log.fingerprint = run_fingerprint(traffic_manager)
+        traffic_manager.event_log.save(record)
+    if trace:
+        traffic_manager.trace.close()
+    return traffic_manager
+
+def print_banner():
     print("=" * 60)
     print("🚦 HỆ THỐNG ĐÈN GIAO THÔNG THÔNG MINH AI")
     print("   Sử dụng Edge Computing & Artificial Intelligence")
     print("=" * 60)
+
+def print_run_summary(traffic_manager, elapsed):
+    cycles = traffic_manager.current_cycle
+    simulated = traffic_manager.clock.now()
+    print(f"📊 {cycles} chu kỳ, {simulated:.0f}s mô phỏng trong {elapsed:.2f}s thực "
+          f"({cycles / elapsed:.0f} chu kỳ/s, {simulated * CONFIG['TICK_RATE'] / elapsed:.0f} bước/s), "
+          f"{traffic_manager.light.total_vehicles_passed} xe đã qua")
+
+def print_profile_report():
+    print("⏱️ Thời gian theo giai đoạn:")
+    for stage, count, total in profiler.summary():
+        print(f"   {stage:<24} {count:>8} lần {total * 1000:>10.1f}ms ({total / count * 1e6:.1f}µs/lần)")
+
+# ==============================
+# ⌨️ DÒNG LỆNH
+# ==============================
+def log_level_option(value):
+    # "console=OFF" -> ("console", "OFF")
+    sink, _, level = value.partition("=")
+    level = level.upper()
+    if sink not in ("console", "file", "dashboard") or level not in LOG_LEVELS:
+        raise argparse.ArgumentTypeError(
+            f"cần dạng NƠI=MỨC với NƠI là console/file/dashboard, MỨC là {'/'.join(LOG_LEVELS)}")
+    return sink, level
+
+def grid_size(value):
+    # "8x8" -> (8, 8)
+    rows, _, cols = value.lower().partition("x")
+    if not (rows.isdigit() and cols.isdigit()) or int(rows) < 1 or int(cols) < 1:
+        raise argparse.ArgumentTypeError("cần dạng HÀNGxCỘT, vd. 8x8")
+    return int(rows), int(cols)
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("phải lớn hơn 0")
+    return number
+
+def non_negative_float(value):
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("không được âm")
+    return number
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Mô phỏng hệ thống đèn giao thông thông minh AI")
+    
+    # Tùy chọn chung cho mọi lệnh
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--cycles", type=int, help="số chu kỳ đèn (mặc định MAX_CYCLES)")
+    common.add_argument("--seed", type=int, help="hạt giống ngẫu nhiên để lặp lại đúng một lần chạy")
+    common.add_argument("--tick-rate", type=positive_float, help="số bước mô phỏng mỗi giây (mặc định TICK_RATE)")
+    common.add_argument("--controller", help="bộ điều khiển đèn: " + ", ".join(CONTROLLERS) +
+                        " hoặc module:Lớp (mặc định CONTROLLER)")
+    common.add_argument("--log-file", help="file log (mặc định LOG_FILE)")
+    common.add_argument("--profile", action="store_true",
+                        help="đo thời gian từng giai đoạn (in cuối simulate, xuất ở /metrics khi serve)")
+    common.add_argument("--log-level", type=log_level_option, action="append", default=[],
+                        metavar="NƠI=MỨC", help="mức log tối thiểu cho console/file/dashboard, vd. console=OFF")
+    
+    # Điểm lưu cho simulate và serve
+    state = argparse.ArgumentParser(add_help=False)
+    state.add_argument("--checkpoint", metavar="FILE", help="lưu toàn bộ trạng thái định kỳ vào file này")
+    state.add_argument("--checkpoint-every", type=int, default=10, metavar="N",
+                       help="lưu sau mỗi N chu kỳ (mặc định 10)")
+    state.add_argument("--restore", metavar="FILE", help="chạy tiếp từ điểm lưu thay vì bắt đầu từ đầu")
+    
+    commands = parser.add_subparsers(dest="command", metavar="{simulate,replay,play,serve,network,replicate,tune,bench}")
+    simulate = commands.add_parser("simulate", parents=[common, state],
+                                   help="chạy nhanh bằng đồng hồ ảo, không web server, không trình duyệt")
+    simulate.add_argument("--state-file", help="ghi trạng thái JSON sau mỗi bước vào file này")
+    simulate.add_argument("--record", metavar="FILE", help="ghi nhật ký xe tới và quyết định pha để phát lại")
+    simulate.add_argument("--trace", metavar="DIR", help="ghi vết từng bước (xe và đèn) dạng cột .npy")
+    
+    replay = commands.add_parser("replay", parents=[common],
+                                 help="phát lại nhật ký của simulate --record và kiểm tra khớp từng bit")
+    replay.add_argument("log", help="file nhật ký")
+    
+    play = commands.add_parser("play", parents=[common],
+                               help="phát vết của simulate --trace lên dashboard, không mô phỏng lại")
+    play.add_argument("trace", help="thư mục vết")
+    play.add_argument("--speed", type=non_negative_float, default=1.0,
+                      help="tốc độ so với thời gian thực (mặc định 1, 0 = dừng)")
+    play.add_argument("--start", type=int, default=0, help="bước bắt đầu")
+    play.add_argument("--port", type=int, help="cổng HTTP (mặc định HTTP_PORT)")
+    play.add_argument("--no-browser", action="store_true", help="không tự mở trình duyệt")
+    
+    serve = commands.add_parser("serve", parents=[common, state],
+                                help="chạy theo thời gian thực kèm dashboard (mặc định)")
+    serve.add_argument("--port", type=int, help="cổng HTTP (mặc định HTTP_PORT)")
+    serve.add_argument("--state-file", help="ghi thêm trạng thái JSON ra file cho công cụ cũ")
+    serve.add_argument("--no-browser", action="store_true", help="không tự mở trình duyệt")
+    serve.add_argument("--warmup", type=float, metavar="MINUTES",
+                       help="chạy trước MINUTES phút mô phỏng hết tốc lực rồi mới chạy theo thời gian thực")
+    
+    # Tùy chọn của chế độ mạng lưới nhiều nút giao
+    grid = argparse.ArgumentParser(add_help=False)
+    grid.add_argument("--workers", type=int, help="số tiến trình (mặc định số CPU)")
+    grid.add_argument("--seconds", type=positive_float, default=300.0,
+                      help="số giây mô phỏng cho mỗi lưới (mặc định 300)")
+    
+    network = commands.add_parser("network", parents=[common, grid],
+                                  help="chạy headless một lưới nhiều nút giao chia cho nhiều tiến trình")
+    network.add_argument("--grid", type=grid_size, default=(4, 4), metavar="HÀNGxCỘT",
+                         help="kích thước lưới (mặc định 4x4)")
+    
+    replicate = commands.add_parser("replicate", parents=[common],
+                                    help="chạy lặp nhiều lần headless song song, báo trung bình kèm khoảng tin cậy 95%%")
+    replicate.add_argument("--runs", type=int, default=20, help="số lần chạy (mặc định 20)")
+    replicate.add_argument("--workers", type=int, help="số tiến trình (mặc định số CPU)")
+    replicate.add_argument("--no-cache", action="store_true", help="không đọc/ghi kết quả trong CACHE_DIR")
+    
+    tune = commands.add_parser("tune", parents=[common],
+                               help="dò song song LIGHT_MIN/MAX, YELLOW_MIN/MAX và ngưỡng mật độ, in biên Pareto")
+    tune.add_argument("--search", choices=("grid", "random", "bayes"), default="random",
+                      help="cách chọn bộ tham số (mặc định random)")
+    tune.add_argument("--trials", type=int, default=32, help="số bộ tham số cho random/bayes (mặc định 32)")
+    tune.add_argument("--runs", type=int, default=5, help="số hạt giống chung cho mỗi bộ (mặc định 5)")
+    tune.add_argument("--workers", type=int, help="số tiến trình (mặc định số CPU)")
+    tune.add_argument("--output", help="ghi mọi bộ đã thử và biên Pareto ra file JSON")
+    tune.add_argument("--no-cache", action="store_true", help="không đọc/ghi kết quả trong CACHE_DIR")
+    
+    bench = commands.add_parser("bench", parents=[common, grid],
+                                help="đo tốc độ mô phỏng headless, lưới nút giao với --network, "
+                                     "môi trường huấn luyện với --env hoặc web server với --http")
+    bench.add_argument("--http", action="store_true", help="đo /api/state thay vì vòng mô phỏng")
+    bench.add_argument("--network", action="store_true", help="đo lưới nút giao với số nút tăng dần")
+    bench.add_argument("--env", type=int, metavar="N", help="đo N môi trường huấn luyện bước cùng lúc")
+    bench.add_argument("--steps", type=int, default=1000, help="số bước mỗi môi trường cho --env")
+    bench.add_argument("--grids", type=grid_size, nargs="+", default=[(1, 1), (4, 4), (8, 8), (16, 16)],
+                       metavar="HÀNGxCỘT", help="các kích thước lưới cho --network")
+    bench.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 64],
+                       help="số kết nối đồng thời cho mỗi lượt đo HTTP")
+    bench.add_argument("--duration", type=positive_float, default=5.0, help="số giây mỗi lượt đo HTTP")
+    return parser
+
+def configure(args):
+    # Áp tùy chọn dòng lệnh lên CONFIG trước khi tạo bất kỳ đối tượng mô phỏng nào
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.cycles is not None:
+        CONFIG["MAX_CYCLES"] = args.cycles
+    if args.tick_rate is not None:
+        CONFIG["TICK_RATE"] = args.tick_rate
+    if args.controller:
+        CONFIG["CONTROLLER"] = args.controller
+    if getattr(args, "port", None) is not None:
+        CONFIG["HTTP_PORT"] = args.port
+    if getattr(args, "state_file", None):
+        CONFIG["STATE_FILE"] = args.state_file
+    if args.profile:
+        CONFIG["PROFILING"] = True
+    profiler.enabled = CONFIG["PROFILING"]
+    if getattr(args, "warmup", None) is not None:
+        CONFIG["WARMUP_MINUTES"] = args.warmup
+    if args.log_file:
+        CONFIG["LOG_FILE"] = args.log_file
+        logger.set_log_file(args.log_file)
+    # Ghi lại vào CONFIG để tiến trình con của chế độ mạng lưới dùng cùng mức log
+    CONFIG["LOG_LEVELS"] = dict(CONFIG["LOG_LEVELS"], **dict(args.log_level))
+    logger.set_levels(**CONFIG["LOG_LEVELS"])
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Không có lệnh con thì chạy dashboard như trước
+    parser = build_parser()
+    args = parser.parse_args(argv or ["serve"])
+    configure(args)
+    try:
+        create_controller()
+    except (ValueError, ImportError, AttributeError) as e:
+        parser.error(f"--controller: {e}")
     
     # Xóa log cũ
     if os.path.exists(CONFIG["LOG_FILE"]):
         os.remove(CONFIG["LOG_FILE"])
     
-    # Khởi tạo hệ thống
-    traffic_manager = TrafficManager()
+    if args.command == "simulate":
+        print(f"⚡ Khởi động trong {(time.perf_counter() - STARTED_AT) * 1000:.0f}ms")
+        started = time.perf_counter()
+        traffic_manager = run_headless(args.cycles, write_data=bool(CONFIG["STATE_FILE"]), seed=args.seed,
+                                       record=args.record, trace=args.trace, restore=args.restore,
+                                       checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every)
+        print_run_summary(traffic_manager, time.perf_counter() - started)
+        if profiler.enabled:
+            logger.close()
+            print_profile_report()
+        return
     
-    def run_simulation():
-        logger.log("🎬 Bắt đầu mô phỏng hệ thống đèn giao thông thông minh", "SYSTEM")
-        
-        try:
-            for cycle in range(1, CONFIG["MAX_CYCLES"] + 1):
-                traffic_manager.run_cycle(cycle)
-                
-                # Nghỉ giữa các chu kỳ
-                if cycle < CONFIG["MAX_CYCLES"]:
-                    time.sleep(2)
-            
-            logger.log("✅ Mô phỏng hoàn tất! Tổng số xe đã qua: " + 
-                      str(traffic_manager.light.total_vehicles_passed), "SYSTEM")
-                      
-        except Exception as e:
-            logger.log(f"❌ Lỗi trong mô phỏng: {str(e)}", "ERROR")
+    if args.command == "play":
+        reader = TraceReader(args.trace)
+        player = TracePlayer(reader, args.speed, args.start)
+        print(f"🎞️ Vết {len(reader)} bước, tốc độ x{args.speed:g}; nhảy tới bước N: /api/seek?tick=N&speed=X")
+        threading.Thread(target=player.run, daemon=True).start()
+        start_web_server(open_browser=not args.no_browser, controls=player.seek)
+        return
+    
+    if args.command == "replay":
+        started = time.perf_counter()
+        traffic_manager, matched = run_replay(args.log)
+        print_run_summary(traffic_manager, time.perf_counter() - started)
+        print("📼 Phát lại khớp từng bit với lần chạy gốc" if matched else "❌ Phát lại lệch so với lần chạy gốc")
+        if not matched:
+            sys.exit(1)
+        return
+    
+    if args.command == "network":
+        rows, cols = args.grid
+        run_network(rows, cols, args.seconds, args.workers, args.seed)
+        return
+    
+    if args.command == "replicate":
+        workers = max(1, min(args.workers or os.cpu_count() or 1, args.runs))
+        started = time.perf_counter()
+        cache = None if args.no_cache else ResultCache()
+        results, summary = run_replications(args.runs, args.seed or 0, workers=workers, cache=cache)
+        print_replication_report(results, summary, time.perf_counter() - started, workers)
+        if cache:
+            print(cache.report())
+        return
+    
+    if args.command == "tune":
+        started = time.perf_counter()
+        cache = None if args.no_cache else ResultCache()
+        evaluated, front = run_tuning(args.search, args.trials, args.runs, args.seed or 0,
+                                      workers=args.workers, cache=cache)
+        print_tuning_report(evaluated, front, time.perf_counter() - started)
+        if cache:
+            print(cache.report())
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"evaluated": evaluated, "pareto_front": front}, f, ensure_ascii=False, indent=2)
+        return
+    
+    print_banner()
+    if args.command == "bench":
+        if args.http:
+            for clients in args.clients:
+                run_http_benchmark(clients, args.duration)
+        elif args.env:
+            run_env_benchmark(args.env, args.steps, args.workers or 1, args.seed)
+        elif args.network:
+            for rows, cols in args.grids:
+                run_network(rows, cols, args.seconds, args.workers, args.seed)
+        else:
+            started = time.perf_counter()
+            traffic_manager = run_headless()
+            print_run_summary(traffic_manager, time.perf_counter() - started)
+        if profiler.enabled:
+            logger.close()
+            print_profile_report()
+        return
+    
+    # Khởi tạo hệ thống (hoặc khôi phục từ điểm lưu)
+    if args.restore:
+        traffic_manager = TrafficManager.from_checkpoint(args.restore, WallClock())
+        if args.cycles is not None:
+            CONFIG["MAX_CYCLES"] = args.cycles
+    elif CONFIG["WARMUP_MINUTES"] > 0:
+        traffic_manager = warm_up(CONFIG["WARMUP_MINUTES"])
+        # Chu kỳ chạy trước không tính vào số chu kỳ của phiên
+        CONFIG["MAX_CYCLES"] += traffic_manager.current_cycle
+    else:
+        traffic_manager = TrafficManager()
     
     # Chạy mô phỏng trong thread riêng
-    sim_thread = threading.Thread(target=run_simulation, daemon=True)
+    sim_thread = threading.Thread(
+        target=run_simulation, args=(traffic_manager, CONFIG["MAX_CYCLES"], args.checkpoint, args.checkpoint_every),
+        daemon=True
+    )
     sim_thread.start()
     
     # Khởi động web server
-    start_web_server()
+    start_web_server(open_browser=not args.no_browser, metrics=lambda: metrics_text(traffic_manager))
 
 if __name__ == "__main__":
     main()
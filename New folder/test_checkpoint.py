@@ -0,0 +1,41 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+import dengiaothong as d
+
+d.logger.set_levels(console="OFF", file="OFF", dashboard="OFF")
+
+def fingerprint(traffic_manager):
+    digest = hashlib.sha256()
+    d.update_digest(digest, traffic_manager)
+    return digest.hexdigest(), traffic_manager.current_cycle, traffic_manager.light.total_vehicles_passed
+
+class CheckpointTest(unittest.TestCase):
+    def test_restore_matches_uninterrupted_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "state.npz")
+            for seed in (1, 2):
+                uninterrupted = d.TrafficManager(clock=d.VirtualClock(), write_data=False, seed=seed)
+                d.run_simulation(uninterrupted, 60)
+                
+                # Dừng giữa chừng (điểm lưu cuối ghi khi run_simulation kết thúc) rồi chạy tiếp
+                interrupted = d.TrafficManager(clock=d.VirtualClock(), write_data=False, seed=seed)
+                d.run_simulation(interrupted, 37, path, 10)
+                restored = d.TrafficManager.from_checkpoint(path, d.VirtualClock(), write_data=False)
+                self.assertEqual(fingerprint(restored), fingerprint(interrupted))
+                d.run_simulation(restored, 60)
+                self.assertEqual(fingerprint(restored), fingerprint(uninterrupted))
+    
+    def test_fork_does_not_disturb_original(self):
+        traffic_manager = d.TrafficManager(clock=d.VirtualClock(), write_data=False, seed=3)
+        d.run_simulation(traffic_manager, 20)
+        before = fingerprint(traffic_manager)
+        fork = traffic_manager.fork()
+        d.run_simulation(fork, 30)
+        self.assertEqual(fingerprint(traffic_manager), before)
+        self.assertEqual(fork.current_cycle, 30)
+
+if __name__ == "__main__":
+    unittest.main()
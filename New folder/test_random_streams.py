@@ -0,0 +1,39 @@
+import unittest
+
+import dengiaothong as d
+
+d.logger.set_levels(console="OFF", file="OFF", dashboard="OFF")
+
+# Hai bộ tham số đèn khác hẳn nhau: thời gian xanh/vàng, số lần rút thời gian vàng
+PARAMETER_SETS = [
+    {"LIGHT_MIN": 8, "LIGHT_MAX": 15, "YELLOW_MIN": 3, "YELLOW_MAX": 5},
+    {"LIGHT_MIN": 20, "LIGHT_MAX": 40, "YELLOW_MIN": 4, "YELLOW_MAX": 6},
+]
+
+def arrivals(params, seed, cycles=30):
+    # Dãy xe tới (thời điểm, làn, loại, vị trí) của một lần chạy headless
+    saved = {key: d.CONFIG[key] for key in params}
+    d.CONFIG.update(params)
+    try:
+        traffic_manager = d.TrafficManager(clock=d.VirtualClock(), write_data=False, seed=seed)
+        traffic_manager.event_log = d.EventLog(seed)
+        d.run_simulation(traffic_manager, cycles)
+    finally:
+        d.CONFIG.update(saved)
+    spawns = [tuple(event[1:]) for event in traffic_manager.event_log.events if event[0] == "spawn"]
+    return spawns, traffic_manager.clock.now()
+
+class CommonRandomNumbersTest(unittest.TestCase):
+    def test_arrivals_do_not_depend_on_light_parameters(self):
+        for seed in (1, 2, 3):
+            (first, first_end), (second, second_end) = (arrivals(params, seed) for params in PARAMETER_SETS)
+            # So trên khoảng thời gian cả hai lần chạy cùng đi qua (xe tới đúng lúc kết thúc
+            # chu kỳ cuối chưa được xử lý)
+            end = min(first_end, second_end)
+            first = [spawn for spawn in first if spawn[0] < end]
+            second = [spawn for spawn in second if spawn[0] < end]
+            self.assertGreater(len(first), 20)
+            self.assertEqual(first, second)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+import dengiaothong as d
+
+d.logger.set_levels(console="OFF", file="OFF", dashboard="OFF")
+
+def record(path, seed, cycles=40):
+    # Lần chạy gốc ghi nhật ký sự kiện kèm mã băm trạng thái, như simulate --record
+    return d.run_headless(cycles, seed=seed, record=path)
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        # run_replay áp CONFIG của lần chạy gốc lên CONFIG toàn cục
+        self.saved = dict(d.CONFIG)
+        self.addCleanup(d.CONFIG.update, self.saved)
+    
+    def test_replay_matches_original_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for seed in (1, 2):
+                path = os.path.join(directory, f"run_{seed}.json")
+                original = record(path, seed)
+                replayed, matched = d.run_replay(path)
+                self.assertTrue(matched)
+                self.assertEqual(replayed.current_cycle, original.current_cycle)
+                self.assertEqual(replayed.light.total_vehicles_passed, original.light.total_vehicles_passed)
+    
+    def test_replay_detects_a_changed_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "run.json")
+            record(path, 1)
+            event_log = d.EventLog.load(path)
+            spawn = next(event for event in event_log.events if event[0] == "spawn")
+            spawn[2] = (spawn[2] + 1) % d.VehicleStore.LANES
+            event_log.save(path)
+            _, matched = d.run_replay(path)
+            self.assertFalse(matched)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import hashlib
+import unittest
+
+import dengiaothong as d
+
+d.logger.set_levels(console="OFF", file="OFF", dashboard="OFF")
+
+def fingerprint(write_data, seed, cycles=40):
+    # Mã băm trạng thái sau mỗi chu kỳ. write_data=True công bố trạng thái ở mọi bước
+    # nên xe đi từng bước một; False thì nhảy nhiều bước một lần giữa hai sự kiện
+    traffic_manager = d.TrafficManager(clock=d.VirtualClock(), write_data=write_data, seed=seed)
+    traffic_manager.digest = hashlib.sha256()
+    d.run_simulation(traffic_manager, cycles)
+    return d.run_fingerprint(traffic_manager), traffic_manager.light.total_vehicles_passed
+
+class TickAdvanceTest(unittest.TestCase):
+    def test_multi_tick_jumps_match_per_tick_stepping(self):
+        for seed in (1, 2, 3):
+            jumped, per_tick = fingerprint(False, seed), fingerprint(True, seed)
+            self.assertGreater(jumped[1], 100)
+            self.assertEqual(jumped, per_tick)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+import http.client
+import http.server
+import urllib.parse
+
+# Module này chỉ được nạp khi cần dashboard hoặc đo tải HTTP, để lệnh
+# `simulate` khởi động nhanh mà không kéo theo http.server
+
+# ==============================
+# 🕹️ WEB SERVER
+# ==============================
+class TrafficHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1: trình duyệt giữ kết nối cho nhiều request thay vì mở lại mỗi lần
+    protocol_version = "HTTP/1.1"
+    # Header và body gửi hai lần: tắt Nagle để không bị trễ ~40ms do ACK chậm
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def handle(self):
+        # Như BaseHTTPRequestHandler.handle, nhưng giữa hai request kết nối rảnh chỉ
+        # được giữ luồng trong keepalive_timeout (ngắn hơn request_timeout)
+        self.handle_one_request()
+        while not self.close_connection:
+            self.connection.settimeout(self.server.keepalive_timeout)
+            try:
+                if not self.rfile.peek(1):
+                    break
+            except OSError:
+                break
+            self.connection.settimeout(self.timeout)
+            self.handle_one_request()
+
+    def log_message(self, format, *args):
+        # Tắt log mặc định của HTTP server
+        pass
+
+    STREAM_KEEPALIVE = 15  # giây
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/api/state":
+            self.send_state()
+        elif path == "/api/stream":
+            self.send_stream()
+        elif path == "/api/seek":
+            self.send_seek()
+        elif path == "/metrics":
+            self.send_metrics()
+        else:
+            super().do_GET()
+
+    def send_state(self):
+        # Trả ảnh chụp trong bộ nhớ; trình duyệt hỏi lại bằng ETag nên bản
+        # không đổi chỉ tốn một phản hồi 304 rỗng
+        version, body = self.server.snapshot.read()
+        etag = f'"{version}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self):
+        # Server-Sent Events: đẩy mỗi bản trạng thái mới tới trình duyệt ngay khi
+        # được công bố, thay cho việc trình duyệt hỏi lại mỗi 500ms
+        # Luồng không có độ dài cố định nên kết nối kết thúc cùng luồng
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        # Người xem mới (hoặc bị tụt lại quá xa) nhận khung đầy đủ gần nhất rồi
+        # các khung delta sau đó; EventSource kết nối lại thì tiếp tục từ Last-Event-ID
+        # "<stream_id>-<seq>" nếu id đó thuộc đúng tiến trình server này
+        snapshot = self.server.snapshot
+        stream_id, _, seq = self.headers.get("Last-Event-ID", "").partition("-")
+        seen_version = int(seq) if stream_id == snapshot.stream_id and seq.isdigit() else 0
+        try:
+            while True:
+                frames = snapshot.wait_for_frames(seen_version, self.STREAM_KEEPALIVE)
+                if frames is None:
+                    # Dòng chú thích giữ kết nối và phát hiện trình duyệt đã đóng
+                    self.wfile.write(b": keep-alive\n\n")
+                else:
+                    for seen_version, body in frames:
+                        self.wfile.write(b"id: %s-%d\ndata: %s\n\n" % (snapshot.stream_id.encode(), seen_version, body))
+                self.wfile.flush()
+        except OSError:
+            # Trình duyệt đã đóng tab hoặc ghi quá thời gian cho phép
+            pass
+
+    def send_seek(self):
+        # Chỉ có khi phát vết: /api/seek?tick=N&speed=X nhảy tới bước N, đổi tốc độ
+        if self.server.controls is None:
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        try:
+            tick = int(query["tick"][0]) if "tick" in query else None
+            speed = float(query["speed"][0]) if "speed" in query else None
+        except ValueError:
+            self.send_error(400)
+            return
+        if speed is not None and speed < 0:
+            self.send_error(400)
+            return
+        tick, speed = self.server.controls(tick=tick, speed=speed)
+        body = json.dumps({"tick": tick, "speed": speed}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_metrics(self):
+        # Số liệu cho Prometheus; chỉ có khi đang chạy mô phỏng trực tiếp
+        if self.server.metrics is None:
+            self.send_error(404)
+            return
+        body = self.server.metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+class TrafficHTTPServer(http.server.ThreadingHTTPServer):
+    # Mỗi kết nối một luồng nhưng có giới hạn: khi đủ luồng, kết nối mới chờ
+    # trong luồng của nó một lúc rồi nhận 503; luồng nhận kết nối không bao giờ chờ
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, snapshot,
+                 max_workers=128, queue_timeout=2.0, request_timeout=30, controls=None, metrics=None,
+                 keepalive_timeout=5):
+        super().__init__(server_address, handler_class)
+        # snapshot: StateSnapshot mà luồng mô phỏng công bố trạng thái vào
+        self.snapshot = snapshot
+        self.workers = threading.BoundedSemaphore(max_workers)
+        # Số kết nối đang chờ worker rảnh; vượt quá thì trả 503 ngay
+        self.waiting = threading.BoundedSemaphore(self.request_queue_size)
+        self.queue_timeout = queue_timeout
+        # Đóng kết nối im lặng hoặc quá chậm sau bao nhiêu giây
+        self.request_timeout = request_timeout
+        # Kết nối keep-alive rảnh giữa hai request được giữ bao nhiêu giây
+        self.keepalive_timeout = keepalive_timeout
+        # Hàm điều khiển phát vết seek(tick, speed), None khi chạy mô phỏng trực tiếp
+        self.controls = controls
+        # Hàm trả nội dung /metrics, None khi không có mô phỏng trực tiếp
+        self.metrics = metrics
+
+    def process_request(self, request, client_address):
+        if not self.waiting.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.waiting.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        # Chờ worker rảnh ngay trong luồng của kết nối: các kết nối chờ song song
+        # và cùng nhận 503 sau queue_timeout
+        acquired = self.workers.acquire(timeout=self.queue_timeout)
+        self.waiting.release()
+        if not acquired:
+            self.reject_request(request)
+            return
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.workers.release()
+
+    def reject_request(self, request):
+        try:
+            request.settimeout(1)
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                            b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+def benchmark_http(url, clients=32, duration=5.0):
+    # Đo số request/giây: `clients` luồng, mỗi luồng một kết nối keep-alive gửi liên tục
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    local_errors += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+                continue
+            local_latencies.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99)
+    }